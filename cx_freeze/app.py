@@ -19,9 +19,12 @@ sys.stdin = dummyStream()
 sys.__stdout__ = dummyStream()
 sys.__stderr__ = dummyStream()
 sys.__stdin__ = dummyStream()
+import multiprocessing
 from PyQt5.QtWidgets import QApplication
 
 if __name__ == "__main__":
+    # Needed for the worker processes used to import dictionaries
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setApplicationName("VocabSieve")
     app.setOrganizationName("FreeLanguageTools")
@@ -14,6 +14,7 @@ build_exe_options = {
         "vocabsieve",
         "setuptools",
         "PyQt5",
+        "PyQt5.QtMultimedia",
         "bs4",
         "lxml",
         "simplemma",
@@ -0,0 +1,55 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from vocabsieve.attached import DSLBackend
+from test_dictzip import write_dictzip
+
+DSL = "﻿#NAME \"Test\"\n#INDEX_LANGUAGE \"English\"\n#CONTENTS_LANGUAGE \"English\"\n\n" + "".join(
+    f"word{i}\nalias{i}\n\t[m1][b]word{i}[/b] [i]noun[/i] meaning number {i}[/m]\n\t[m2][ex]an example[/ex][/m]\n\n"
+    for i in range(2000))
+
+
+class DSLBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, "cache")
+        data = DSL.encode("utf-8")
+        self.plain = os.path.join(self.dir.name, "plain.dsl")
+        with open(self.plain, "wb") as f:
+            f.write(data)
+        self.dictzip = os.path.join(self.dir.name, "dictzip.dsl.dz")
+        write_dictzip(self.dictzip, data, 4096)
+        self.gzip = os.path.join(self.dir.name, "gzip.dsl.dz")
+        with gzip.open(self.gzip, "wb") as f:
+            f.write(data)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def definitions(self, path, cache_dir):
+        backend = DSLBackend(path, cache_dir)
+        try:
+            self.assertEqual(len(backend), 4000)
+            # Backwards too, which plain gzip cannot seek cheaply
+            words = ["word1999", "word0", "alias1000", "word5", "missing"]
+            return [backend.define(word) for word in words]
+        finally:
+            backend.close()
+
+    def test_compressed_files_match_plain(self):
+        expected = self.definitions(self.plain, None)
+        self.assertIn("meaning number 1999", expected[0])
+        self.assertIsNone(expected[-1])
+        for path in (self.dictzip, self.gzip):
+            for cache_dir in (None, self.cache_dir):
+                with self.subTest(path=path, cache_dir=cache_dir):
+                    self.assertEqual(self.definitions(path, cache_dir), expected)
+        # Plain gzip is decompressed once, and opened again from the copy
+        self.assertTrue(any(name.endswith(".dsl") for name in os.listdir(self.cache_dir)))
+        self.assertEqual(self.definitions(self.gzip, self.cache_dir), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from vocabsieve.db import LocalDictionary
+
+
+def create_old_database(dbpath: str, entries: dict, name: str = "old"):
+    "A database as created before the full-text index existed"
+    conn = sqlite3.connect(dbpath)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS dictionary (
+        word TEXT,
+        definition TEXT,
+        language TEXT,
+        dictname TEXT
+    )
+    """)
+    conn.executemany("""
+    INSERT INTO dictionary(word, definition, language, dictname)
+    VALUES(?, ?, 'en', ?)
+    """, [(word, definition, name) for word, definition in entries.items()])
+    conn.commit()
+    conn.close()
+
+
+class FtsBackfillTest(unittest.TestCase):
+    entries = {f"word{i}": f"meaning number {i}" for i in range(1000)}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dbpath = os.path.join(self.dir.name, "dict.db")
+        create_old_database(self.dbpath, self.entries)
+        create_old_database(self.dbpath, {f"gone{i}": f"meaning {i}" for i in range(200)}, "gone")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def check_index(self, db: LocalDictionary):
+        # Compares the index with the dictionary table
+        db.c.execute("INSERT INTO dictionary_fts(dictionary_fts) VALUES('integrity-check')")
+
+    def test_upgrade(self):
+        db = LocalDictionary(self.dbpath)
+        if not db.has_fts:
+            self.skipTest("No FTS5 in this SQLite build")
+        for _ in range(100):
+            if db.ftsProgress() is None:
+                break
+            time.sleep(0.1)
+        self.assertIsNone(db.ftsProgress())
+        self.check_index(db)
+        self.assertEqual(db.search("number 999", "en", mode="definition"),
+                         [{"word": "word999", "dictname": "old"}])
+        db.conn.close()
+        # Not filled again on the next start
+        with mock.patch.object(LocalDictionary, "backfillFts") as backfill:
+            db = LocalDictionary(self.dbpath)
+        backfill.assert_not_called()
+        db.conn.close()
+
+    def test_changes_while_filling(self):
+        with mock.patch.object(LocalDictionary, "backfillFts"):
+            db = LocalDictionary(self.dbpath)
+        if not db.has_fts:
+            self.skipTest("No FTS5 in this SQLite build")
+        self.assertEqual(db.ftsProgress(), 0)
+        with self.assertRaises(NotImplementedError):
+            db.search("meaning", "en", mode="definition")
+        # Rows that are yet to be indexed are deleted, and their rowids
+        # are reused by the next imports
+        db.deletedict("gone")
+        db.importdict({"new": "a new meaning"}, "en", "new")
+        db.importdict({"compressed": "a compressed meaning"}, "en", "compressed", compress=True)
+        db.deletedict("new")
+        db.backfillFts(batch_size=64)
+        self.assertIsNone(db.ftsProgress())
+        self.check_index(db)
+        results = db.search("meaning", "en", mode="definition", limit=2000)
+        self.assertEqual(len(results), len(self.entries) + 1)
+        self.assertIn({"word": "compressed", "dictname": "compressed"}, results)
+        db.conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import gzip
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from vocabsieve.dictzip import DictzipFile
+
+
+def write_dictzip(path: str, data: bytes, chunk_length: int):
+    "Write data as a dictzip file, in chunks of chunk_length bytes"
+    chunks = []
+    for i in range(0, len(data), chunk_length):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        chunks.append(compressor.compress(data[i:i + chunk_length]) + compressor.flush(zlib.Z_FULL_FLUSH))
+    ra = struct.pack("<HHH", 1, chunk_length, len(chunks)) \
+        + b"".join(struct.pack("<H", len(chunk)) for chunk in chunks)
+    extra = b"RA" + struct.pack("<H", len(ra)) + ra
+    header = b"\x1f\x8b\x08\x04" + b"\0" * 4 + b"\x02\x03" + struct.pack("<H", len(extra)) + extra
+    end = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+    with open(path, "wb") as f:
+        f.write(header + b"".join(chunks) + end
+                + struct.pack("<II", zlib.crc32(data), len(data) & 0xffffffff))
+
+
+class DictzipFileTest(unittest.TestCase):
+    data = b"".join(b"line %d of the dictionary\n" % i for i in range(5000))
+    # Ranges read in that order, including backwards seeks and ranges
+    # across chunk boundaries
+    ranges = [(0, 10), (50000, 3000), (100, 1), (999, 2), (len(data) - 5, 5), (0, len(data))]
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def check(self, path: str, chunked: bool):
+        f = DictzipFile(path)
+        try:
+            self.assertEqual(f.chunked, chunked)
+            for offset, size in self.ranges:
+                self.assertEqual(f.read(offset, size), self.data[offset:offset + size])
+        finally:
+            f.close()
+
+    def test_dictzip(self):
+        path = os.path.join(self.dir.name, "a.dict.dz")
+        write_dictzip(path, self.data, 1000)
+        self.check(path, True)
+
+    def test_plain_gzip(self):
+        path = os.path.join(self.dir.name, "b.dict.dz")
+        with gzip.open(path, "wb") as f:
+            f.write(self.data)
+        self.check(path, False)
+
+    def test_not_gzip(self):
+        path = os.path.join(self.dir.name, "c.dict.dz")
+        with open(path, "wb") as f:
+            f.write(self.data)
+        with self.assertRaises(ValueError):
+            DictzipFile(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import json
+import os
+import unittest
+from dataclasses import asdict
+
+from vocabsieve.forvo import Forvo
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "forvo")
+
+
+class ForvoParseTest(unittest.TestCase):
+    # Word pages with the markup of Forvo's, and the pronunciations the
+    # BeautifulSoup parser found in them before it was replaced by lxml
+    def test_matches_old_parser(self):
+        with open(os.path.join(FIXTURES, "expected.json"), encoding="utf-8") as f:
+            expected = json.load(f)
+        for key, pronunciations in expected.items():
+            word, lang = key.split("/")
+            with open(os.path.join(FIXTURES, word + ".html"), encoding="utf-8") as f:
+                page = f.read()
+            with self.subTest(word=word, lang=lang):
+                self.assertEqual([asdict(p) for p in Forvo(word, lang).parse(page)], pronunciations)
+
+    def test_kinds_of_pronunciations(self):
+        with open(os.path.join(FIXTURES, "expected.json"), encoding="utf-8") as f:
+            pronunciations = [p for ps in json.load(f).values() for p in ps]
+        # The fixtures cover ogg-only files, votes missing or negative and
+        # names outside of a link
+        self.assertTrue(any(p["is_ogg"] for p in pronunciations))
+        self.assertTrue(any(p["votes"] < 0 for p in pronunciations))
+        self.assertTrue(any(p["votes"] == 0 for p in pronunciations))
+        self.assertTrue(len({p["origin"] for p in pronunciations}) > 2)
+
+    def test_empty_page(self):
+        self.assertEqual(Forvo("word", "en").parse(""), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,13 @@
-from flask import Flask, request
+from flask import Flask, Response, request
 from PyQt5.QtCore import *
 from .dictionary import *
 from .db import Record
 import logging
+import mimetypes
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
+# Most results /search returns at once
+SEARCH_MAX_LIMIT = 1000
 
 
 def str2bool(v):
@@ -24,6 +27,9 @@ class LanguageServer(QObject):
         """ Main server application """
         self.app = Flask(__name__)
         self.settings = QSettings()
+        # Entries of attached dictionaries link to their media files here
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        dictdb.resource_url = f"http://{host}:{self.port}/resource"
 
         @self.app.route("/healthcheck")
         def healthcheck():
@@ -38,6 +44,32 @@ class LanguageServer(QObject):
             use_lemmatize = str2bool(request.args.get("lemmatize", "True"))
             return self.parent.lookup(word, use_lemmatize)
 
+        @self.app.route("/search/<string:query>")
+        def search(query):
+            lang = request.args.get(
+                "lang") or self.settings.value("target_language")
+            # Invalid limits fall back to the default
+            limit = max(1, min(request.args.get("limit", 20, type=int), SEARCH_MAX_LIMIT))
+            try:
+                results = dictdb.search(
+                    query,
+                    lang,
+                    request.args.get("dict"),
+                    request.args.get("mode", "prefix"),
+                    limit)
+            except NotImplementedError as e:
+                return {"error": str(e)}, 400
+            return {"query": query, "lang": lang, "results": results}
+
+        @self.app.route("/resource/<string:dictname>/<path:filename>")
+        def resource(dictname, filename):
+            data = dictdb.resource(dictname, filename)
+            if data is None:
+                return "Not found", 404
+            return Response(
+                data,
+                mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+
         @self.app.route("/translate", methods=["POST"])
         def translate():
             lang = request.args.get(
@@ -72,6 +104,20 @@ class LanguageServer(QObject):
         def lemmatize(word):
             return lem_word(word, self.settings.value("target_language"))
 
+        @self.app.route("/analysis/<int:text_id>")
+        def analysis(text_id):
+            # Imported here, the reader database is only opened when used
+            from .ext.reader.server import app as reader_app, Text, analyze_text
+            with reader_app.app_context():
+                text = Text.query.get(text_id)
+                if text is None:
+                    return {"error": f"No text with ID {text_id}"}, 404
+                return analyze_text(
+                    text,
+                    self.settings.value("target_language"),
+                    self.settings.value("freq_source", "<disabled>"),
+                    str2bool(request.args.get("refresh", "False")))
+
         @self.app.route("/logs")
         def logs():
             rec = Record()
@@ -0,0 +1,616 @@
+"""
+Dictionaries served directly from their original files ("attached"),
+rather than imported into the database. Every backend provides:
+- len(backend): number of headwords
+- backend.define(word): the definition, or None if not found
+- backend.headwords(): iterator over all the headwords
+- backend.close()
+Backends may also provide backend.resource(name) for media files, and
+backend.linkResources(html, url) to make the references of an entry to
+them point to url, where they are served.
+"""
+import codecs
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote
+from readmdict import MDX, MDD
+from .dictzip import DictzipFile
+from .dictformats import mdx_stylesheet, dsl_headword, clean_dsl_entry
+from .dsl import iter_entries
+from .xdxftransform import xdxf2html
+try:
+    import lzo
+except ImportError:
+    lzo = None
+
+
+def cache_file(cache_dir: Optional[str], source: str, suffix: str) -> Optional[str]:
+    "Path of a cache file for source, which becomes stale when source changes"
+    if cache_dir is None:
+        return None
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return os.path.join(cache_dir, hashlib.md5(key.encode()).hexdigest() + suffix)
+
+
+class StarDictBackend():
+    """
+    Reads StarDict dictionaries in place.
+    The .idx file is memory-mapped, and only an array of the positions of
+    its entries is kept, which is enough to binary search it since StarDict
+    sorts entries. The array is saved in cache_dir to skip the scan the
+    next time the dictionary is opened.
+    """
+
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
+        basename = os.path.splitext(path)[0]
+        self.lock = threading.Lock()
+        self.ifo = self.readIfo(basename + ".ifo")
+        self.sametypesequence = self.ifo.get("sametypesequence", "")
+        if self.ifo.get("idxoffsetbits") == "64":
+            self.entry_format = ">QI"
+        else:
+            self.entry_format = ">II"
+        self.entry_size = struct.calcsize(self.entry_format)
+
+        self.idx: Union[mmap.mmap, bytes]
+        if os.path.exists(basename + ".idx"):
+            with open(basename + ".idx", "rb") as f:
+                self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            idxpath = basename + ".idx"
+        else:
+            with gzip.open(basename + ".idx.gz", "rb") as f:
+                self.idx = f.read()
+            idxpath = basename + ".idx.gz"
+
+        if os.path.exists(basename + ".dict"):
+            with open(basename + ".dict", "rb") as f:
+                self.dict = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.dictzip = None
+        else:
+            self.dictzip = DictzipFile(basename + ".dict.dz")
+
+        self.positions = self.loadPositions(idxpath, cache_dir)
+
+    @staticmethod
+    def readIfo(path: str) -> Dict[str, str]:
+        ifo = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                key, sep, value = line.partition("=")
+                if sep:
+                    ifo[key.strip()] = value.strip()
+        return ifo
+
+    def loadPositions(self, idxpath: str, cache_dir: Optional[str]) -> array:
+        positions = array("Q")
+        cache = cache_file(cache_dir, idxpath, ".pos")
+        if cache is not None and os.path.exists(cache):
+            with open(cache, "rb") as f:
+                positions.frombytes(f.read())
+            return positions
+        pos = 0
+        end = len(self.idx)
+        find = self.idx.find
+        skip = 1 + self.entry_size
+        while pos < end:
+            positions.append(pos)
+            pos = find(b"\0", pos) + skip
+        if cache is not None:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            # Renamed once complete, so that an interrupted write is not
+            # read as the cache the next time
+            with open(cache + ".tmp", "wb") as f:
+                positions.tofile(f)
+            os.replace(cache + ".tmp", cache)
+        return positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def entry(self, n: int) -> Tuple[bytes, int, int]:
+        pos = self.positions[n]
+        end = self.idx.find(b"\0", pos)
+        offset, size = struct.unpack_from(self.entry_format, self.idx, end + 1)
+        return self.idx[pos:end], offset, size
+
+    def headword(self, n: int) -> bytes:
+        pos = self.positions[n]
+        return self.idx[pos:self.idx.find(b"\0", pos)]
+
+    def headwords(self) -> Iterator[str]:
+        for n in range(len(self.positions)):
+            yield self.headword(n).decode("utf-8", "replace")
+
+    def find(self, word: bytes) -> List[int]:
+        "Indices of all the entries for word"
+        # StarDict sorts by ASCII case-insensitive comparison first,
+        # then by plain byte comparison
+        key = (word.lower(), word)
+        lo, hi = 0, len(self.positions)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            headword = self.headword(mid)
+            if (headword.lower(), headword) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = []
+        while lo < len(self.positions) and self.headword(lo) == word:
+            result.append(lo)
+            lo += 1
+        return result
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self.dictzip is not None:
+            return self.dictzip.read(offset, size)
+        return self.dict[offset:offset + size]
+
+    def fields(self, data: bytes) -> List[Tuple[str, bytes]]:
+        """
+        Split an article into (type, data) fields.
+        Lowercase types are null-terminated text, uppercase types are
+        binary data prefixed with their size. With sametypesequence, the
+        types are omitted and so is the terminator or size of the last field.
+        """
+        result = []
+        pos = 0
+        types = self.sametypesequence
+        i = 0
+        while pos < len(data):
+            if types:
+                if i >= len(types):
+                    break
+                t = types[i]
+                last = i == len(types) - 1
+                i += 1
+            else:
+                t = chr(data[pos])
+                pos += 1
+                last = False
+            if t.islower():
+                end = len(data) if last else data.find(b"\0", pos)
+                if end == -1:
+                    end = len(data)
+                result.append((t, data[pos:end]))
+                pos = end + 1
+            else:
+                if last:
+                    size = len(data) - pos
+                else:
+                    size, = struct.unpack_from(">I", data, pos)
+                    pos += 4
+                result.append((t, data[pos:pos + size]))
+                pos += size
+        return result
+
+    def define(self, word: str) -> Optional[str]:
+        with self.lock:
+            articles = []
+            for n in self.find(word.encode("utf-8")):
+                _, offset, size = self.entry(n)
+                for t, data in self.fields(self.read(offset, size)):
+                    if not t.islower():
+                        continue  # Resources such as images and sounds
+                    text = data.decode("utf-8", "replace")
+                    articles.append(xdxf2html(text) if t == "x" else text)
+        if not articles:
+            return None
+        return "\n".join(articles).replace("\\n", "\n")
+
+    def close(self):
+        if isinstance(self.idx, mmap.mmap):
+            self.idx.close()
+        if self.dictzip is not None:
+            self.dictzip.close()
+        else:
+            self.dict.close()
+
+
+class MDictRecords():
+    """
+    Random access to the records of an MDX or MDD file.
+    readmdict already keeps the key index in memory, mapping every key to
+    the position of its record in the concatenation of all the record
+    blocks. The record block table is read here as well, so that only the
+    block containing a record needs to be decompressed. Recently used
+    blocks are kept in an LRU cache.
+    """
+
+    def __init__(self, mdict, cache_size: int = 16):
+        self.mdict = mdict
+        self.keys = mdict._key_list
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, bytes] = OrderedDict()
+        self.file = open(mdict._fname, "rb")
+        self.file.seek(mdict._record_block_offset)
+        num_blocks = mdict._read_number(self.file)
+        for _ in range(3):
+            # Number of entries, size of block table and of all blocks
+            mdict._read_number(self.file)
+        sizes = [(mdict._read_number(self.file), mdict._read_number(self.file))
+                 for _ in range(num_blocks)]
+        # (offset in file, compressed size, decompressed size) of each block
+        self.blocks: List[Tuple[int, int, int]] = []
+        self.block_starts: List[int] = []
+        file_offset = self.file.tell()
+        start = 0
+        for compressed_size, decompressed_size in sizes:
+            self.blocks.append((file_offset, compressed_size, decompressed_size))
+            self.block_starts.append(start)
+            file_offset += compressed_size
+            start += decompressed_size
+
+    def block(self, n: int) -> bytes:
+        if n in self.cache:
+            self.cache.move_to_end(n)
+            return self.cache[n]
+        file_offset, compressed_size, decompressed_size = self.blocks[n]
+        self.file.seek(file_offset)
+        compressed = self.file.read(compressed_size)
+        # 4 bytes of compression type, 4 bytes of checksum
+        block_type = compressed[:4]
+        if block_type == b"\x00\x00\x00\x00":
+            block = compressed[8:]
+        elif block_type == b"\x01\x00\x00\x00":
+            if lzo is None:
+                raise NotImplementedError("LZO compression is not supported")
+            header = b"\xf0" + struct.pack(">I", decompressed_size)
+            block = lzo.decompress(header + compressed[8:])
+        elif block_type == b"\x02\x00\x00\x00":
+            block = zlib.decompress(compressed[8:])
+        else:
+            raise ValueError("Unknown record block compression")
+        self.cache[n] = block
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return block
+
+    def record(self, i: int) -> bytes:
+        "The record of the i-th key"
+        start = self.keys[i][0]
+        n = bisect_right(self.block_starts, start) - 1
+        block_start = self.block_starts[n]
+        block = self.block(n)
+        if i + 1 < len(self.keys):
+            end = self.keys[i + 1][0]
+        else:
+            end = block_start + len(block)
+        return block[start - block_start:end - block_start]
+
+    def close(self):
+        self.file.close()
+
+
+# src and href attributes of entries, which may refer to files of the .mdd
+re_mdx_link = re.compile(r"""(\b(?:src|href)\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+# Links with a scheme other than sound://, such as entry:// or http://
+re_url_scheme = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+
+class MDXBackend():
+    """
+    Reads MDX dictionaries in place, decompressing only the record block
+    that contains a requested headword.
+    Media referenced by the entries are read from the .mdd file with the
+    same name, if there is one.
+    """
+
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
+        self.lock = threading.Lock()
+        mdx = MDX(path)
+        self.encoding = mdx._encoding or "UTF-8"
+        # readmdict converts UTF-16 keys to UTF-8
+        key_encoding = "UTF-8" if self.encoding.startswith("UTF") else self.encoding
+        self.stylesheet = mdx_stylesheet(mdx)
+        self.records = MDictRecords(mdx)
+        self.index: Dict[str, List[int]] = {}
+        for i, (_, key) in enumerate(self.records.keys):
+            self.index.setdefault(key.decode(key_encoding, "replace"), []).append(i)
+
+        self.resources = None
+        self.resource_index: Dict[str, int] = {}
+        mddpath = os.path.splitext(path)[0] + ".mdd"
+        if os.path.exists(mddpath):
+            self.resources = MDictRecords(MDD(mddpath))
+            for i, (_, key) in enumerate(self.resources.keys):
+                self.resource_index[self.resourceKey(key.decode("utf-8", "replace"))] = i
+
+    @staticmethod
+    def resourceKey(name: str) -> str:
+        "MDD keys look like \\images\\a.png, but are referred to as images/a.png"
+        return "\\" + name.replace("/", "\\").lstrip("\\").lower()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def headwords(self) -> Iterator[str]:
+        return iter(self.index.keys())
+
+    def define(self, word: str) -> Optional[str]:
+        if word not in self.index:
+            return None
+        with self.lock:
+            entries = [self.records.record(i) for i in self.index[word]]
+        # Converted to UTF-8 like readmdict does when importing
+        return b"".join(
+            self.stylesheet.expand(
+                entry.decode(self.encoding, errors="ignore").strip("\x00").encode("utf-8"))
+            for entry in entries).decode("utf-8")
+
+    def linkResources(self, definition: str, url: str) -> str:
+        """
+        Point the sound:// links and the relative paths of an entry that
+        refer to files of the .mdd file to url followed by their name
+        """
+        if not self.resource_index:
+            return definition
+
+        def link(m: "re.Match[str]") -> str:
+            name = m.group(3)
+            if name.startswith("sound://"):
+                name = name[len("sound://"):]
+            elif name.startswith(("#", "//")) or re_url_scheme.match(name):
+                return m.group(0)
+            if self.resourceKey(name) not in self.resource_index:
+                return m.group(0)
+            name = name.replace("\\", "/").lstrip("/")
+            return m.group(1) + m.group(2) + url + quote(name) + m.group(2)
+        return re_mdx_link.sub(link, definition)
+
+    def resource(self, name: str) -> Optional[bytes]:
+        "Get a file, such as an image or a sound, from the .mdd file"
+        i = self.resource_index.get(self.resourceKey(name))
+        if self.resources is None or i is None:
+            return None
+        with self.lock:
+            return self.resources.record(i)
+
+    def close(self):
+        self.records.close()
+        if self.resources is not None:
+            self.resources.close()
+
+
+class DSLBackend():
+    """
+    Reads Lingvo DSL dictionaries, plain or dictzipped, in place.
+    The file is scanned once to build an index of the position and length
+    of the entry of every headword, which is saved in cache_dir. A lookup
+    then reads only the bytes of that entry, which for .dsl.dz files means
+    decompressing only the dictzip chunks that hold it, and converts its
+    markup to HTML. .dsl.dz files compressed with plain gzip cannot be
+    read at random, so they are decompressed once into cache_dir.
+    """
+
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.compressed = path.lower().endswith(".dz")
+        with self.openRaw(path) as f:
+            self.encoding, bom_length = self.detectEncoding(f.read(4096))
+        cache = cache_file(cache_dir, path, ".dslidx")
+        if cache is None:
+            self.index = sqlite3.connect(":memory:", check_same_thread=False)
+            self.buildIndex(path, bom_length)
+        elif os.path.exists(cache):
+            self.index = sqlite3.connect(cache, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            # Built under a temporary name so that an interrupted scan
+            # does not leave an incomplete index behind
+            self.index = sqlite3.connect(cache + ".tmp", check_same_thread=False)
+            self.index.execute("DROP TABLE IF EXISTS entries")
+            self.buildIndex(path, bom_length)
+            self.index.close()
+            os.replace(cache + ".tmp", cache)
+            self.index = sqlite3.connect(cache, check_same_thread=False)
+        self.length: int = self.index.execute(
+            "SELECT COUNT(DISTINCT headword) FROM entries").fetchone()[0]
+
+        self.dictzip: Optional[DictzipFile] = None
+        self.data: Union[mmap.mmap, bytes] = b""
+        if self.compressed:
+            dictzip = DictzipFile(path)
+            if dictzip.chunked:
+                self.dictzip = dictzip
+            else:
+                dictzip.close()
+                self.data = self.decompress(path, cache_dir)
+        else:
+            self.data = self.map(path)
+
+    @staticmethod
+    def map(path: str) -> mmap.mmap:
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def decompress(self, path: str, cache_dir: Optional[str]) -> Union[mmap.mmap, bytes]:
+        "The data of a plain gzip file, decompressed into cache_dir if given"
+        plain = cache_file(cache_dir, path, ".dsl")
+        if plain is None:
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        if not os.path.exists(plain):
+            with gzip.open(path, "rb") as f, open(plain + ".tmp", "wb") as out:
+                shutil.copyfileobj(f, out)
+            os.replace(plain + ".tmp", plain)
+        return self.map(plain)
+
+    def openRaw(self, path: str):
+        if self.compressed:
+            return gzip.open(path, "rb")
+        return open(path, "rb")
+
+    @staticmethod
+    def detectEncoding(head: bytes) -> Tuple[str, int]:
+        "Encoding of a DSL file and the length of its byte order mark"
+        if head.startswith(codecs.BOM_UTF8):
+            return "utf-8", len(codecs.BOM_UTF8)
+        if head.startswith(codecs.BOM_UTF16_LE):
+            return "utf-16-le", len(codecs.BOM_UTF16_LE)
+        if head.startswith(codecs.BOM_UTF16_BE):
+            return "utf-16-be", len(codecs.BOM_UTF16_BE)
+        try:
+            # Incremental, so that a character cut at the end is not an error
+            codecs.getincrementaldecoder("utf-8")().decode(head)
+        except UnicodeDecodeError:
+            return "utf-16-le", 0
+        return "utf-8", 0
+
+    def buildIndex(self, path: str, bom_length: int):
+        self.index.execute(
+            "CREATE TABLE entries(headword TEXT, offset INTEGER, length INTEGER)")
+        rows: List[Tuple[str, int, int]] = []
+        with self.openRaw(path) as raw:
+            raw.read(bom_length)
+            lines = io.TextIOWrapper(raw, encoding=self.encoding, newline="")
+            pos = bom_length
+            start = pos
+            headwords: List[str] = []
+            in_header = True
+            in_text = False
+            for line in lines:
+                length = len(line.encode(self.encoding))
+                stripped = line.rstrip()
+                if in_header and (not stripped or stripped.startswith("#")):
+                    pos += length
+                    continue
+                in_header = False
+                if stripped and not line.startswith((" ", "\t")):
+                    if in_text:
+                        rows.extend((dsl_headword(h), start, pos - start) for h in headwords)
+                        headwords = []
+                        in_text = False
+                    if not headwords:
+                        start = pos
+                    headwords.append(stripped)
+                elif stripped:
+                    in_text = True
+                pos += length
+            if in_text:
+                rows.extend((dsl_headword(h), start, pos - start) for h in headwords)
+        self.index.executemany("INSERT INTO entries VALUES(?, ?, ?)", rows)
+        self.index.execute("CREATE INDEX entries_headword ON entries(headword)")
+        self.index.commit()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def headwords(self) -> Iterator[str]:
+        with self.lock:
+            rows = self.index.execute("SELECT DISTINCT headword FROM entries").fetchall()
+        return (row[0] for row in rows)
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self.dictzip is not None:
+            return self.dictzip.read(offset, size)
+        return self.data[offset:offset + size]
+
+    def define(self, word: str) -> Optional[str]:
+        with self.lock:
+            rows = self.index.execute(
+                "SELECT offset, length FROM entries WHERE headword = ?", (word,)).fetchall()
+            texts = [self.read(offset, length).decode(self.encoding, "replace")
+                     for offset, length in rows]
+        articles = []
+        for text in texts:
+            for _, definition in iter_entries(text.split("\n")):
+                articles.append(clean_dsl_entry(definition))
+        if not articles:
+            return None
+        return "\n".join(articles)
+
+    def close(self):
+        self.index.close()
+        if self.dictzip is not None:
+            self.dictzip.close()
+        elif isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+attached_formats = {
+    "stardict": StarDictBackend,
+    "mdx": MDXBackend,
+    "dsl": DSLBackend,
+}
+
+
+
+def benchmark(path: str, lookups: int = 1000, seed: int = 0):
+    """
+    Compare reading an MDX dictionary in place with importing it into a
+    database: the time to open or import it, the time of a lookup, and
+    the memory allocated by Python for it.
+    Run with python -m vocabsieve.attached dictionary.mdx [lookups]
+    """
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+    from .db import LocalDictionary
+    from .dictformats import parseMDX
+
+    start = time.perf_counter()
+    backend = MDXBackend(path)
+    open_time = time.perf_counter() - start
+    words = random.Random(seed).sample(list(backend.headwords()), min(lookups, len(backend)))
+    start = time.perf_counter()
+    for word in words:
+        backend.define(word)
+    lookup_time = (time.perf_counter() - start) / len(words)
+    backend.close()
+    del backend
+    # Measured separately, tracing makes opening much slower
+    tracemalloc.start()
+    backend = MDXBackend(path)
+    for word in words:
+        backend.define(word)
+    # Includes the cached record blocks
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    backend.close()
+    del backend
+    print(f"in place: open {open_time:.2f} s, lookup {lookup_time * 1000:.3f} ms, "
+          f"memory {memory / 2**20:.1f} MiB, {peak / 2**20:.1f} MiB at peak")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbpath = os.path.join(tmpdir, "dict.db")
+        db = LocalDictionary(dbpath)
+        start = time.perf_counter()
+        db.importdict(parseMDX(path), "xx", "bench")
+        import_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for word in words:
+            db.define(word, "xx", "bench")
+        lookup_time = (time.perf_counter() - start) / len(words)
+        db.conn.close()
+        size = os.path.getsize(dbpath)
+    # Once imported, the entries are in the database file instead
+    tracemalloc.start()
+    entries = parseMDX(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del entries
+    print(f"imported: import {import_time:.2f} s, lookup {lookup_time * 1000:.3f} ms, "
+          f"{peak / 2**20:.1f} MiB at peak")
+    print(f"database: {size / 2**20:.1f} MiB, dictionary: {os.path.getsize(path) / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m vocabsieve.attached dictionary.mdx [lookups]")
+    benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
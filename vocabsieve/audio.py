@@ -0,0 +1,340 @@
+"""
+Downloading, caching and playback of pronunciation audio.
+Downloads run on a worker thread and playback never blocks the caller,
+so that nothing here holds up the GUI thread.
+"""
+import os
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import requests
+from os import path
+from pathlib import Path
+from PyQt5.QtCore import QObject, QStandardPaths, QUrl, pyqtSignal
+from playsound import PlaysoundException, playsound
+try:
+    from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
+    QT_MULTIMEDIA = True
+except ImportError:
+    # QtMultimedia is not in every PyQt5 build, and fails to load when
+    # the system audio libraries are missing
+    QT_MULTIMEDIA = False
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+datapath = QStandardPaths.writableLocation(QStandardPaths.DataLocation)
+# Downloaded audio files
+cachepath = path.join(datapath, "forvo")
+Path(cachepath).mkdir(parents=True, exist_ok=True)
+# Least recently played files are deleted above this size
+CACHE_MAX_SIZE = 200 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 10
+# Download priorities, lower first
+PRIORITY_PLAY = 0
+PRIORITY_PREFETCH = 1
+
+
+class AudioCache():
+    """
+    Directory of downloaded audio files, kept under max_size bytes by
+    deleting the least recently used files.
+    Use is tracked with the modification time of the files, which
+    survives restarts. The sizes are only read from disk once.
+    """
+
+    def __init__(self, root: str, max_size: int = CACHE_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.files: Optional[OrderedDict[str, int]] = None
+        self.size = 0
+
+    def path(self, name: str, url: str, lang: str) -> str:
+        "Where the file of a pronunciation is saved once downloaded"
+        return path.join(self.root, lang, name) + url[-4:]
+
+    def scan(self) -> "OrderedDict[str, int]":
+        found = []
+        for dirpath, _dirs, filenames in os.walk(self.root):
+            for filename in filenames:
+                fpath = path.join(dirpath, filename)
+                try:
+                    stat = os.stat(fpath)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, fpath, stat.st_size))
+        found.sort()
+        self.files = OrderedDict((fpath, size) for _mtime, fpath, size in found)
+        self.size = sum(self.files.values())
+        return self.files
+
+    def touch(self, fpath: str) -> bool:
+        "Mark a file as just used. Returns whether it is in the cache"
+        try:
+            os.utime(fpath)
+        except OSError:
+            return False
+        with self.lock:
+            if self.files is not None and fpath in self.files:
+                self.files.move_to_end(fpath)
+        return True
+
+    def add(self, fpath: str):
+        "Account for a file just written, then evict old files if needed"
+        with self.lock:
+            files = self.files if self.files is not None else self.scan()
+            self.size -= files.pop(fpath, 0)
+            files[fpath] = os.path.getsize(fpath)
+            self.size += files[fpath]
+            while self.size > self.max_size and len(files) > 1:
+                oldest, size = files.popitem(last=False)
+                self.size -= size
+                try:
+                    os.remove(oldest)
+                except OSError:
+                    pass
+
+
+class Download():
+    def __init__(self, url: str, fpath: str, priority: int):
+        self.url = url
+        self.fpath = fpath
+        self.priority = priority
+        self.done = threading.Event()
+        self.ok = False
+
+
+class Downloader(QObject):
+    """
+    Downloads audio files into the cache on a worker thread.
+    Requesting a file that is already queued or being downloaded does not
+    download it twice, but can raise its priority.
+    """
+    finished = pyqtSignal(str, bool)
+
+    def __init__(self, cache: AudioCache):
+        super().__init__()
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Download] = {}
+        self.queue: queue.PriorityQueue = queue.PriorityQueue()
+        # Breaks ties in the queue in request order
+        self.counter = itertools.count()
+        self.worker: Optional[threading.Thread] = None
+
+    def fetch(self, url: str, fpath: str, priority: int = PRIORITY_PREFETCH) -> Download:
+        with self.lock:
+            job = self.jobs.get(fpath)
+            if job is None:
+                job = self.jobs[fpath] = Download(url, fpath, priority)
+            elif priority < job.priority:
+                # Queued again, the worker skips the entry left behind
+                job.priority = priority
+            else:
+                return job
+            self.queue.put((priority, next(self.counter), job))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.work, daemon=True)
+                self.worker.start()
+        return job
+
+    def downloading(self, fpath: str) -> bool:
+        "Whether a file is queued or being downloaded"
+        with self.lock:
+            return fpath in self.jobs
+
+    def wait(self, fpath: str, timeout: float = DOWNLOAD_TIMEOUT) -> bool:
+        "Wait for a file to be downloaded if it is queued. Returns whether it exists"
+        job = self.jobs.get(fpath)
+        if job is not None:
+            job.done.wait(timeout)
+        return path.exists(fpath)
+
+    def work(self):
+        while True:
+            _priority, _n, job = self.queue.get()
+            if job.done.is_set():
+                continue
+            try:
+                job.ok = self.download(job.url, job.fpath)
+            except (requests.RequestException, OSError):
+                job.ok = False
+            with self.lock:
+                self.jobs.pop(job.fpath, None)
+            job.done.set()
+            self.finished.emit(job.fpath, job.ok)
+
+    def download(self, url: str, fpath: str) -> bool:
+        if self.cache.touch(fpath):
+            return True
+        with requests.get(url, headers=HEADERS, stream=True, timeout=DOWNLOAD_TIMEOUT) as res:
+            if res.status_code != 200:
+                return False
+            os.makedirs(path.dirname(fpath), exist_ok=True)
+            # Written under another name first, so that a partial file is
+            # never mistaken for a downloaded one
+            tmppath = fpath + ".part"
+            with open(tmppath, 'bw') as file:
+                for chunk in res.iter_content(64 * 1024):
+                    file.write(chunk)
+        os.replace(tmppath, fpath)
+        self.cache.add(fpath)
+        return True
+
+
+class AudioPlayer(QObject):
+    """
+    Plays audio files and URLs one after the other.
+    play() interrupts whatever is playing and drops the queue, enqueue()
+    plays after the rest and skip() moves on to the next one.
+    Files that are being downloaded are played once the downloader is
+    done with them, so that each file is only requested once, with the
+    headers Forvo expects. Without Qt Multimedia, playsound plays the
+    files on a thread; it cannot stop a file halfway, so play() only
+    drops what is queued.
+    """
+
+    def __init__(self, downloader: Downloader):
+        super().__init__()
+        self.downloader = downloader
+        # Sources to play, as (url or local path, local path) pairs
+        self.pending: List[tuple] = []
+        self.current: Optional[tuple] = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.player: Optional[QMediaPlayer] = None
+        if QT_MULTIMEDIA:
+            self.player = QMediaPlayer(self)
+            if self.player.isAvailable():
+                self.player.mediaStatusChanged.connect(self.onMediaStatus)
+                self.player.error.connect(self.onError)
+                self.downloader.finished.connect(self.onDownloaded)
+            else:
+                self.player = None
+        if self.player is None:
+            threading.Thread(target=self.playsoundWorker, daemon=True).start()
+
+    def play(self, source: str, fpath: Optional[str] = None):
+        with self.lock:
+            self.pending = [(source, fpath or source)]
+        if self.player is not None:
+            self.next()
+        else:
+            with self.wakeup:
+                self.wakeup.notify()
+
+    def enqueue(self, source: str, fpath: Optional[str] = None):
+        with self.lock:
+            self.pending.append((source, fpath or source))
+        if self.player is not None:
+            if self.player.state() == QMediaPlayer.State.StoppedState:
+                self.next()
+        else:
+            with self.wakeup:
+                self.wakeup.notify()
+
+    def skip(self):
+        if self.player is not None:
+            self.next()
+
+    def stop(self):
+        with self.lock:
+            self.pending = []
+        if self.player is not None:
+            self.current = None
+            self.player.stop()
+
+    def next(self):
+        if self.player is None:
+            return
+        with self.lock:
+            self.current = self.pending.pop(0) if self.pending else None
+        self.player.stop()
+        if self.current is None:
+            return
+        fpath = self.current[1]
+        # Checked first, as the file is written before the download is
+        # done, and then onDownloaded plays it
+        downloading = self.downloader.downloading(fpath)
+        if path.exists(fpath):
+            self.setSource(QUrl.fromLocalFile(path.abspath(fpath)))
+        elif not downloading:
+            self.next()
+
+    def setSource(self, url: QUrl):
+        if self.player is None:
+            return
+        self.player.setMedia(QMediaContent(url))
+        self.player.play()
+
+    def onMediaStatus(self, status):
+        if status == QMediaPlayer.MediaStatus.EndOfMedia:
+            self.next()
+        elif status == QMediaPlayer.MediaStatus.InvalidMedia:
+            self.onError()
+
+    def onError(self, *_args):
+        if self.current is not None:
+            self.next()
+
+    def onDownloaded(self, fpath: str, ok: bool):
+        if self.current is None or self.current[1] != fpath:
+            return
+        if ok and self.player is not None and self.player.state() == QMediaPlayer.State.StoppedState:
+            self.setSource(QUrl.fromLocalFile(path.abspath(fpath)))
+        elif not ok:
+            self.next()
+
+    def playsoundWorker(self):
+        while True:
+            with self.wakeup:
+                while not self.pending:
+                    self.wakeup.wait()
+                self.current = self.pending.pop(0)
+            _source, fpath = self.current
+            if self.downloader.wait(fpath):
+                try:
+                    playsound(path.abspath(fpath))
+                except PlaysoundException:
+                    pass
+            self.current = None
+
+
+cache = AudioCache(cachepath)
+downloader = Downloader(cache)
+_player: Optional[AudioPlayer] = None
+
+
+def player() -> AudioPlayer:
+    "The audio player, created on first use since it needs the Qt application"
+    global _player
+    if _player is None:
+        _player = AudioPlayer(downloader)
+    return _player
+
+
+def prefetch_audio(name: str, url: str, lang: str):
+    "Download the file of a pronunciation in the background"
+    fpath = cache.path(name, url, lang)
+    if not path.exists(fpath):
+        downloader.fetch(url, fpath, PRIORITY_PREFETCH)
+
+
+def play_url(name: str, url: str, lang: str) -> str:
+    """
+    Play a pronunciation from the cache, or else as soon as it is
+    downloaded, ahead of the prefetched ones. Returns where the file is saved.
+    """
+    fpath = cache.path(name, url, lang)
+    if cache.touch(fpath):
+        player().play(fpath)
+    else:
+        downloader.fetch(url, fpath, PRIORITY_PLAY)
+        player().play(url, fpath)
+    return fpath
+
+
+def play_file(fpath: str):
+    player().play(path.abspath(fpath))
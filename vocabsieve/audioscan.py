@@ -0,0 +1,66 @@
+"""
+Scanning of audio library folders for the audio index.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class ScannedDir(NamedTuple):
+    directory: str  # Relative to the root of the library, "" for the root
+    parent: Optional[str]
+    mtime: int
+    files: Optional[List[str]]  # None if unchanged since the last scan
+    subdirs: List[str]
+
+
+def scanDir(root: str, directory: str, parent: Optional[str],
+            mtimes: Dict[str, int], subdirs: Dict[str, List[str]]) -> Optional[ScannedDir]:
+    try:
+        mtime = os.stat(os.path.join(root, directory)).st_mtime_ns
+    except OSError:
+        return None
+    if mtimes.get(directory) == mtime:
+        return ScannedDir(directory, parent, mtime, None, subdirs.get(directory, []))
+    files = []
+    dirs = []
+    try:
+        with os.scandir(os.path.join(root, directory)) as it:
+            for entry in it:
+                relpath = os.path.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(relpath)
+                elif entry.is_file():
+                    files.append(relpath)
+    except OSError:
+        return None
+    return ScannedDir(directory, parent, mtime, files, dirs)
+
+
+def scan(root: str, mtimes: Dict[str, int], subdirs: Dict[str, List[str]],
+         workers: int = 8) -> Tuple[List[ScannedDir], List[str]]:
+    """
+    Walk the folders of an audio library, one level at a time, listing
+    the folders of each level in parallel.
+    Adding, removing or renaming a file only changes the modification time
+    of the folder it is in. So folders whose modification time is still
+    the one in mtimes, from the previous scan, are not listed again, and
+    their subfolders are taken from subdirs instead.
+    Returns the folders found, and the folders of the previous scan that
+    no longer exist.
+    """
+    found: List[ScannedDir] = []
+    level: List[Tuple[str, Optional[str]]] = [("", None)]
+    with ThreadPoolExecutor(workers) as executor:
+        while level:
+            results = executor.map(
+                lambda item: scanDir(root, item[0], item[1], mtimes, subdirs), level)
+            level = []
+            for result in results:
+                if result is None:
+                    continue
+                found.append(result)
+                level.extend((subdir, result.directory) for subdir in result.subdirs)
+    seen = {item.directory for item in found}
+    removed = [directory for directory in mtimes if directory not in seen]
+    return found, removed
@@ -54,6 +54,12 @@ class SettingsDialog(QDialog):
         self.reader_fontsize.setMaximum(200)
         self.reader_hlcolor = QPushButton(self.settings.value("reader_hlcolor", "#66bb77"))
         self.reader_hlcolor.clicked.connect(self.save_color)
+        self.reader_known_rank = QSpinBox()
+        self.reader_known_rank.setMinimum(0)
+        self.reader_known_rank.setMaximum(1000000)
+        self.reader_known_rank.setToolTip(
+            "Words up to this rank in the frequency list are not highlighted in the reader." +
+            "\nSet to 0 to only count words you mined as known.")
 
         self.word_field = QComboBox()
         self.frequency_stars_field = QComboBox()
@@ -317,6 +323,7 @@ class SettingsDialog(QDialog):
         self.tab_i.layout.addRow(QLabel("Reader font"), self.reader_font)
         self.tab_i.layout.addRow(QLabel("Reader font size"), self.reader_fontsize)
         self.tab_i.layout.addRow(QLabel("Reader highlight color"), self.reader_hlcolor)
+        self.tab_i.layout.addRow(QLabel("Reader known words up to rank"), self.reader_known_rank)
 
         self.tab_p.layout.addRow(QLabel("<h3>Per-dictionary postprocessing options</h3>"))
         self.tab_p.layout.addRow(QLabel("Configure for dictionary:"), self.postproc_selector)
@@ -486,6 +493,7 @@ class SettingsDialog(QDialog):
 
         self.register_config_handler(self.reader_font, "reader_font", "serif")
         self.register_config_handler(self.reader_fontsize, "reader_fontsize", 14)
+        self.register_config_handler(self.reader_known_rank, "reader_known_rank", 0)
 
         self.register_config_handler(self.allow_editing, 'allow_editing', True)
         self.register_config_handler(self.primary, 'primary', False)
@@ -1,12 +1,21 @@
+import os
 import sqlite3
+import zlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 from PyQt5.QtCore import QStandardPaths, QCoreApplication
 from os import path
 from pathlib import Path
 import time
+import threading
 from bidict import bidict
 import pycountry
 import re
 from datetime import datetime, timedelta
+from urllib.parse import quote
+from .fuzzy import SymSpell
+from .attached import attached_formats
+from .audioscan import scan as scan_audio
 datapath = QStandardPaths.writableLocation(QStandardPaths.DataLocation)
 Path(datapath).mkdir(parents=True, exist_ok=True)
 print(datapath)
@@ -216,14 +225,59 @@ class Record():
         self.createTables()
 
 
+def train_zdict(samples: List[str], size: int = 32768) -> bytes:
+    """
+    Build a preset dictionary for zlib out of the tags and words that
+    repeat across entries, such as stylesheets and formatting boilerplate.
+    zlib can only refer back 32 KiB and finds closer matches cheaper,
+    so the most common fragments are placed at the end.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        # Count each fragment once per entry, we want what is shared
+        counts.update(set(re.findall(r"<[^>]{2,}>|[^<>\s]{4,}", sample)))
+    fragments = [(fragment, n) for fragment, n in counts.items() if n > 1]
+    fragments.sort(key=lambda x: x[1] * len(x[0]), reverse=True)
+    zdict = b""
+    for fragment, _ in fragments:
+        encoded = fragment.encode("utf-8")
+        if len(zdict) + len(encoded) > size:
+            break
+        zdict = encoded + zdict
+    return zdict
+
+
 class LocalDictionary():
-    def __init__(self):
-        self.conn = sqlite3.connect(
-            path.join(
-                datapath,
-                "dict.db"),
-            check_same_thread=False)
+    def __init__(self, dbpath: Optional[str] = None) -> None:
+        self.dbpath = dbpath or path.join(datapath, "dict.db")
+        self.conn = sqlite3.connect(self.dbpath, check_same_thread=False)
         self.c = self.conn.cursor()
+        # Fuzzy matching indices, built on first use for each dictionary
+        self.fuzzy: Dict[Tuple[str, str], SymSpell] = {}
+        # Those being built on worker threads, and how many times the
+        # indices were cleared, so that a stale one is not kept
+        self.fuzzy_building: Set[Tuple[str, str]] = set()
+        self.fuzzy_generation = 0
+        self.fuzzy_lock = threading.Lock()
+        # Preset dictionaries of compressed dictionaries
+        self.zdicts: Dict[str, bytes] = {}
+        # Backends of dictionaries read from their original files,
+        # opened on first use
+        self.backends: Dict[str, Any] = {}
+        # Names of the attached dictionaries, read on first use, so that
+        # imported ones do not cost a query to find they are not attached
+        self.attached: Optional[Set[str]] = None
+        # Where the API serves the media files of attached dictionaries,
+        # set once it is started, so that their entries can link to them
+        self.resource_url: Optional[str] = None
+        # Lets SQL see the text of compressed definitions, e.g. for indexing
+        self.conn.create_function(
+            "decompress_definition", 2, self.decompress, deterministic=True)
+        # Rows (indexed, last] of a database created before the full-text
+        # index existed, which a worker thread is yet to add to it.
+        # Changes to the index are made holding the lock meanwhile.
+        self.fts_backfill: Optional[Tuple[int, int]] = None
+        self.fts_lock = threading.Lock()
         self.createTables()
 
     def createTables(self):
@@ -235,47 +289,631 @@ class LocalDictionary():
             dictname TEXT
         )
         """)
+        # Serves both exact lookups and prefix range scans on headwords
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS dictionary_lookup
+        ON dictionary (language, dictname, word)
+        """)
+        # External content table: only the index is stored, the text itself
+        # stays in the dictionary table. Not every SQLite build has FTS5.
+        self.c.execute("""
+        SELECT COUNT(*) FROM sqlite_master WHERE name='dictionary_fts'
+        """)
+        fts_existed = bool(self.c.fetchone()[0])
+        try:
+            self.c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS dictionary_fts USING fts5 (
+                word,
+                definition,
+                content='dictionary',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS dictinfo (
+            dictname TEXT PRIMARY KEY,
+            zdict BLOB
+        )
+        """)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS attached (
+            dictname TEXT PRIMARY KEY,
+            language TEXT,
+            type TEXT,
+            path TEXT
+        )
+        """)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS audiolib (
+            dictname TEXT PRIMARY KEY,
+            language TEXT,
+            path TEXT
+        )
+        """)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS audio (
+            headword TEXT,
+            file TEXT,
+            directory TEXT,
+            language TEXT,
+            dictname TEXT
+        )
+        """)
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS audio_lookup
+        ON audio (language, headword)
+        """)
+        self.c.execute("""
+        CREATE INDEX IF NOT EXISTS audio_directory
+        ON audio (dictname, directory)
+        """)
+        # Folders of audio libraries as of the last scan
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS audio_dirs (
+            dictname TEXT,
+            directory TEXT,
+            parent TEXT,
+            mtime INTEGER,
+            files INTEGER,
+            PRIMARY KEY (dictname, directory)
+        )
+        """)
+        try:
+            self.c.execute("""
+            ALTER TABLE audio_dirs ADD COLUMN files INTEGER
+            """)
+        except sqlite3.OperationalError:
+            pass
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS fts_backfill (
+            indexed INTEGER,
+            last INTEGER
+        )
+        """)
+        if self.has_fts and not fts_existed:
+            # Databases created before the index existed need it filled
+            # once. That can take minutes, so it is done on a worker thread,
+            # and resumed on the next start if it is interrupted.
+            self.c.execute("""
+            DELETE FROM fts_backfill
+            """)
+            self.c.execute("""
+            INSERT INTO fts_backfill(indexed, last)
+            SELECT 0, rowid FROM dictionary
+            ORDER BY rowid DESC
+            LIMIT 1
+            """)
         self.conn.commit()
+        if self.has_fts:
+            self.c.execute("""
+            SELECT indexed, last FROM fts_backfill
+            """)
+            backfill = self.c.fetchone()
+            if backfill is not None:
+                self.fts_backfill = backfill
+                threading.Thread(target=self.backfillFts, daemon=True).start()
+
+    def backfillFts(self, batch_size: int = 20000):
+        """
+        Add the rows of self.fts_backfill to the full-text index, a batch
+        at a time, so that imports are not blocked for long
+        """
+        # Opened here, the database connection belongs to this thread
+        conn = sqlite3.connect(self.dbpath, timeout=1)
+        conn.create_function(
+            "decompress_definition", 2, self.decompress, deterministic=True)
+        try:
+            while True:
+                with self.fts_lock:
+                    if self.fts_backfill is None:
+                        return
+                    indexed, last = self.fts_backfill
+                    try:
+                        upto = conn.execute("""
+                        SELECT MAX(rowid) FROM (
+                            SELECT rowid FROM dictionary
+                            WHERE rowid > ? AND rowid <= ?
+                            ORDER BY rowid
+                            LIMIT ?
+                        )
+                        """, (indexed, last, batch_size)).fetchone()[0]
+                        if upto is None:
+                            upto = last
+                        conn.execute("""
+                        INSERT INTO dictionary_fts(rowid, word, definition)
+                        SELECT rowid, word, decompress_definition(dictname, definition) FROM dictionary
+                        WHERE rowid > ? AND rowid <= ?
+                        """, (indexed, upto))
+                        if upto < last:
+                            conn.execute("""
+                            UPDATE fts_backfill SET indexed=?
+                            """, (upto,))
+                        else:
+                            conn.execute("""
+                            DELETE FROM fts_backfill
+                            """)
+                        conn.commit()
+                    except sqlite3.OperationalError:
+                        # Locked by an import in progress, tried again later
+                        conn.rollback()
+                    else:
+                        self.fts_backfill = (upto, last) if upto < last else None
+                        continue
+                time.sleep(1)
+        finally:
+            conn.close()
 
-    def importdict(self, data: dict, lang: str, name: str):
+    def ftsProgress(self) -> Optional[float]:
+        "How much of the full-text index is filled, or None if it is complete"
+        backfill = self.fts_backfill
+        if backfill is None:
+            return None
+        return backfill[0] / backfill[1]
+
+    def ftsFilter(self) -> Tuple[str, Tuple[int, ...]]:
+        """
+        SQL condition on rowid leaving out the rows the worker filling the
+        full-text index is yet to add, and its parameters
+        """
+        if self.fts_backfill is None:
+            return "", ()
+        return "AND (rowid <= ? OR rowid > ?)", self.fts_backfill
+
+    def importdict(self, data: dict, lang: str, name: str, compress: bool = False):
+        """
+        Import entries into the database.
+        If compress is set, definitions are stored zlib-compressed with
+        a preset dictionary trained on this dictionary's entries.
+        """
+        zdict = b""
+        if compress and data:
+            values = list(data.values())
+            # An even spread of entries across the alphabet
+            step = max(len(values) // 2000, 1)
+            zdict = train_zdict(values[::step])
+            self.c.execute("""
+                INSERT OR REPLACE INTO dictinfo(dictname, zdict)
+                VALUES(?, ?)
+                """, (name, zdict))
+            self.zdicts[name] = zdict
         for item in data.items():
             # Handle escape sequences
+            text: str = item[1].replace("\\n", "\n")
+            definition: Union[str, bytes] = text
+            if compress:
+                compressor = zlib.compressobj(9, zdict=zdict)
+                definition = compressor.compress(text.encode("utf-8")) + compressor.flush()
             self.c.execute("""
                 INSERT INTO dictionary(word, definition, language, dictname)
                 VALUES(?, ?, ?, ?)
                 """,
                            (
                                item[0].lower() if item[0].isupper() else item[0],  # no caps
-                               item[1].replace("\\n", "\n"),
+                               definition,
                                lang,
                                name
                            )
                            )
+        if self.has_fts:
+            with self.fts_lock:
+                condition, params = self.ftsFilter()
+                self.c.execute(f"""
+                    INSERT INTO dictionary_fts(rowid, word, definition)
+                    SELECT rowid, word, decompress_definition(dictname, definition) FROM dictionary
+                    WHERE dictname=? {condition}
+                    """, (name,) + params)
+                self.conn.commit()
+        else:
+            self.conn.commit()
+        self.clearFuzzy()
+
+    def attach(self, path: str, dicttype: str, lang: str, name: str):
+        """
+        Register a dictionary to be read directly from its files
+        instead of being copied into the database.
+        """
+        if dicttype not in attached_formats:
+            raise NotImplementedError("Format cannot be attached")
+        # Opened now rather than on the first lookup, so that files that
+        # cannot be read are reported here and their indices are built
+        backend = attached_formats[dicttype](path, os.path.join(datapath, "attached"))
+        self.c.execute("""
+            INSERT OR REPLACE INTO attached(dictname, language, type, path)
+            VALUES(?, ?, ?, ?)
+            """, (name, lang, dicttype, path))
         self.conn.commit()
+        self.closeBackend(name)
+        self.backends[name] = backend
+        self.clearFuzzy()
+
+    def indexAudio(self, name: str, lang: str, root: str):
+        """
+        Index the files of an audio library folder by headword, which is
+        the file name without extension.
+        Only the folders modified since the last scan are listed again,
+        so this is also how the index is kept up to date.
+        """
+        row = self.conn.execute("""
+            SELECT language, path FROM audiolib
+            WHERE dictname=?
+            """, (name,)).fetchone()
+        if row is not None and row[1] != root:
+            self.clearAudio(name)
+        elif row is not None and row[0] != lang:
+            self.c.execute("""
+                UPDATE audio SET language=?
+                WHERE dictname=?
+                """, (lang, name))
+        self.c.execute("""
+            INSERT OR REPLACE INTO audiolib(dictname, language, path)
+            VALUES(?, ?, ?)
+            """, (name, lang, root))
+
+        mtimes: Dict[str, int] = {}
+        subdirs: Dict[str, List[str]] = defaultdict(list)
+        for directory, parent, mtime, files in self.conn.execute("""
+                SELECT directory, parent, mtime, files FROM audio_dirs
+                WHERE dictname=?
+                """, (name,)).fetchall():
+            if files is not None:
+                mtimes[directory] = mtime
+            if parent is not None:
+                subdirs[parent].append(directory)
+        scanned, removed = scan_audio(root, mtimes, subdirs)
+
+        for directory in removed:
+            self.c.execute("""
+                DELETE FROM audio
+                WHERE dictname=? AND directory=?
+                """, (name, directory))
+            self.c.execute("""
+                DELETE FROM audio_dirs
+                WHERE dictname=? AND directory=?
+                """, (name, directory))
+        for item in scanned:
+            if item.files is None:
+                continue
+            self.c.execute("""
+                DELETE FROM audio
+                WHERE dictname=? AND directory=?
+                """, (name, item.directory))
+            self.c.executemany("""
+                INSERT INTO audio(headword, file, directory, language, dictname)
+                VALUES(?, ?, ?, ?, ?)
+                """, (
+                (os.path.splitext(os.path.basename(file))[0].lower(), file, item.directory, lang, name)
+                for file in item.files))
+            self.c.execute("""
+                INSERT OR REPLACE INTO audio_dirs(dictname, directory, parent, mtime, files)
+                VALUES(?, ?, ?, ?, ?)
+                """, (name, item.directory, item.parent, item.mtime, len(item.files)))
+        self.conn.commit()
+
+    def isAudioIndexed(self, name: str) -> bool:
+        count: int = self.conn.execute("""
+            SELECT COUNT(*) FROM audiolib
+            WHERE dictname=?
+            """, (name,)).fetchone()[0]
+        return count > 0
+
+    def clearAudio(self, name: str):
+        for table in ("audio", "audio_dirs", "audiolib"):
+            self.c.execute(f"""
+                DELETE FROM {table}
+                WHERE dictname=?
+                """, (name,))
+
+    def audio(self, word: str, lang: str, names: List[str]) -> List[Tuple[str, str, str]]:
+        """
+        Audio files for word in the given libraries, as tuples of
+        (library, folder of the library, path relative to the folder).
+        Files are ranked by the priority of their library, which is its
+        position in names, then by the number of recordings in their
+        folder. Libraries such as LinguaLibre have a folder per speaker,
+        so speakers who recorded the most come first.
+        """
+        if not names:
+            return []
+        placeholders = ",".join("?" * len(names))
+        priority = " ".join(f"WHEN ? THEN {i}" for i in range(len(names)))
+        rows: List[Tuple[str, str, str]] = self.conn.execute(f"""
+            SELECT a.dictname, l.path, a.file FROM audio AS a
+            JOIN audiolib AS l ON l.dictname = a.dictname
+            LEFT JOIN audio_dirs AS d
+                ON d.dictname = a.dictname AND d.directory = a.directory
+            WHERE a.language=? AND a.headword=?
+            AND a.dictname IN ({placeholders})
+            ORDER BY CASE a.dictname {priority} END, d.files DESC, a.directory, a.file
+            """, (lang, word, *names, *names)).fetchall()
+        return rows
+
+    def getBackend(self, name: str) -> Any:
+        "Get the backend of an attached dictionary, or None if not attached"
+        if name not in self.backends:
+            if self.attached is None:
+                self.attached = {row[0] for row in self.conn.execute("SELECT dictname FROM attached")}
+            if name not in self.attached:
+                return None
+            row = self.conn.execute("""
+            SELECT type, path FROM attached
+            WHERE dictname=?
+            """, (name,)).fetchone()
+            if row is None:
+                return None
+            dicttype, dictpath = row
+            self.backends[name] = attached_formats[dicttype](
+                dictpath, path.join(datapath, "attached"))
+        return self.backends[name]
+
+    def closeBackend(self, name: str):
+        "Close the backend of a dictionary, for when it is attached again or deleted"
+        self.attached = None
+        backend = self.backends.pop(name, None)
+        if backend is not None:
+            backend.close()
 
     def deletedict(self, name: str):
+        if self.has_fts:
+            # Entries must be removed from an external content index
+            # with the exact values they were indexed with, and only if
+            # they were indexed.
+            with self.fts_lock:
+                condition, params = self.ftsFilter()
+                self.c.execute(f"""
+                    INSERT INTO dictionary_fts(dictionary_fts, rowid, word, definition)
+                    SELECT 'delete', rowid, word, decompress_definition(dictname, definition) FROM dictionary
+                    WHERE dictname=? {condition}
+                    """, (name,) + params)
+                self.c.execute("""
+                    DELETE FROM dictionary
+                    WHERE dictname=?
+                """, (name,))
+                self.conn.commit()
+        else:
+            self.c.execute("""
+                DELETE FROM dictionary
+                WHERE dictname=?
+            """, (name,))
         self.c.execute("""
-            DELETE FROM dictionary
+            DELETE FROM dictinfo
             WHERE dictname=?
         """, (name,))
+        self.zdicts.pop(name, None)
+        self.c.execute("""
+            DELETE FROM attached
+            WHERE dictname=?
+        """, (name,))
+        self.clearAudio(name)
+        self.closeBackend(name)
         self.conn.commit()
+        self.clearFuzzy()
+
+    def defineAttached(self, backend: Any, word: str, name: str) -> Optional[str]:
+        definition: Optional[str] = backend.define(word)
+        if definition is not None and self.resource_url is not None \
+                and hasattr(backend, "linkResources"):
+            definition = backend.linkResources(
+                definition, f"{self.resource_url}/{quote(name, safe='')}/")
+        return definition
 
     def define(self, word: str, lang: str, name: str) -> str:
+        backend = self.getBackend(name)
+        if backend is not None:
+            definition = self.defineAttached(backend, word, name)
+            if definition is None:
+                raise KeyError(word)
+            return definition
         self.c.execute("""
         SELECT definition FROM dictionary
         WHERE word=?
         AND language=?
         AND dictname=?
         """, (word, lang, name))
-        return str(self.c.fetchone()[0])
+        return self.decompress(name, self.c.fetchone()[0])
+
+    def resource(self, name: str, filename: str) -> Optional[bytes]:
+        "Get a media file from an attached dictionary that provides them"
+        backend = self.getBackend(name)
+        if backend is None or not hasattr(backend, "resource"):
+            return None
+        data: Optional[bytes] = backend.resource(filename)
+        return data
+
+    def define_many(self, words: List[str], lang: str, names: List[str]) -> Dict[str, Dict[str, str]]:
+        """
+        Look up several words in several dictionaries with a single query.
+        Returns the entries found as {dictname: {word: definition}}.
+        """
+        result: Dict[str, Dict[str, str]] = {name: {} for name in names}
+        backends = {name: self.getBackend(name) for name in names}
+        for name, backend in backends.items():
+            if backend is None:
+                continue
+            for word in words:
+                definition = self.defineAttached(backend, word, name)
+                if definition is not None:
+                    result[name][word] = definition
+        names = [name for name in names if backends[name] is None]
+        if not words or not names:
+            return result
+        # Stay well below SQLite's limit on the number of variables
+        for i in range(0, len(words), 500):
+            chunk = words[i:i + 500]
+            self.c.execute(f"""
+            SELECT word, dictname, definition FROM dictionary
+            WHERE language=?
+            AND dictname IN ({", ".join("?" * len(names))})
+            AND word IN ({", ".join("?" * len(chunk))})
+            """, [lang] + list(names) + list(chunk))
+            for word, name, definition in self.c.fetchall():
+                if word not in result[name]:
+                    result[name][word] = self.decompress(name, definition)
+        return result
+
+    def decompress(self, name: str, definition: Union[str, bytes]) -> str:
+        "Get the text of a definition, which may be stored compressed"
+        if not isinstance(definition, bytes):
+            return str(definition)
+        if name not in self.zdicts:
+            # Use a separate cursor, this may be called from within a query
+            zdict = self.conn.execute("""
+            SELECT zdict FROM dictinfo
+            WHERE dictname=?
+            """, (name,)).fetchone()
+            self.zdicts[name] = zdict[0] if zdict else b""
+        decompressor = zlib.decompressobj(zdict=self.zdicts[name])
+        return decompressor.decompress(definition).decode("utf-8")
+
+    def search(self, query: str, lang: str, name: Optional[str] = None,
+               mode: str = "prefix", limit: int = 20) -> List[Dict[str, str]]:
+        """
+        Search headwords in local dictionaries of a language.
+        mode can be one of:
+        - "prefix": headwords starting with query, shortest first, as the
+          closest completions, then by code point
+        - "headword": full-text match on headwords, ranked by relevance
+        - "definition": reverse lookup, full-text match inside definitions
+        If name is None, all dictionaries for the language are searched.
+        Full-text searches raise NotImplementedError until the index is
+        filled, see backfillFts.
+        """
+        query = query.strip()
+        if not query:
+            return []
+        dict_filter = "AND d.dictname=?" if name is not None else ""
+        params: List[Union[str, int]]
+        if mode == "prefix":
+            # A range scan on the lookup index rather than LIKE, which
+            # cannot use the index because of its case folding
+            sql = f"""
+            SELECT d.word, d.dictname FROM dictionary AS d
+            WHERE d.language=?
+            {dict_filter}
+            AND d.word >= ? AND d.word < ?
+            ORDER BY length(d.word), d.word
+            LIMIT ?
+            """
+            params = [lang] + ([name] if name is not None else []) \
+                + [query, query + "\U0010ffff"] + [limit]
+        elif mode in ("headword", "definition"):
+            if not self.has_fts:
+                raise NotImplementedError("Full-text search is not supported by this SQLite build")
+            progress = self.ftsProgress()
+            if progress is not None:
+                raise NotImplementedError(
+                    f"Full-text search is not available until the index is built ({progress:.0%} done)")
+            column = "word" if mode == "headword" else "definition"
+            # Quote the user input so that it is never parsed as FTS syntax
+            terms = " ".join(
+                column + ' : "' + term.replace('"', '""') + '"'
+                for term in query.split())
+            sql = f"""
+            SELECT d.word, d.dictname FROM dictionary_fts AS f
+            JOIN dictionary AS d ON d.rowid = f.rowid
+            WHERE dictionary_fts MATCH ?
+            AND d.language=?
+            {dict_filter}
+            ORDER BY f.rank
+            LIMIT ?
+            """
+            params = [terms, lang] + ([name] if name is not None else []) + [limit]
+        else:
+            raise NotImplementedError("Search mode not supported")
+        self.c.execute(sql, params)
+        return [{"word": word, "dictname": dictname}
+                for word, dictname in self.c.fetchall()]
+
+    def clearFuzzy(self):
+        with self.fuzzy_lock:
+            self.fuzzy.clear()
+            self.fuzzy_building.clear()
+            self.fuzzy_generation += 1
+
+    def buildFuzzy(self, lang: str, name: str):
+        """
+        Start building the suggestion index of a dictionary on a worker
+        thread, unless it is built or being built already.
+        This takes seconds for large dictionaries, so it is done when a
+        dictionary is imported and for the selected ones at startup.
+        Only a couple of indices are kept in memory at once.
+        """
+        key = (lang, name)
+        with self.fuzzy_lock:
+            if key in self.fuzzy or key in self.fuzzy_building:
+                return
+            self.fuzzy_building.add(key)
+            generation = self.fuzzy_generation
+        # Opened here, the database connection belongs to this thread
+        backend = self.getBackend(name)
+        threading.Thread(target=self.fuzzyWorker, args=(key, backend, generation), daemon=True).start()
+
+    def fuzzyWorker(self, key: Tuple[str, str], backend: Any, generation: int):
+        index: Optional[SymSpell] = None
+        try:
+            if backend is not None:
+                index = SymSpell(backend.headwords(), max_distance=2)
+            else:
+                conn = sqlite3.connect(self.dbpath)
+                try:
+                    index = SymSpell((row[0] for row in conn.execute("""
+                        SELECT word FROM dictionary
+                        WHERE language=?
+                        AND dictname=?
+                        """, key)), max_distance=2)
+                finally:
+                    conn.close()
+        finally:
+            with self.fuzzy_lock:
+                if generation == self.fuzzy_generation:
+                    self.fuzzy_building.discard(key)
+                    if index is not None:
+                        if len(self.fuzzy) >= 2:
+                            del self.fuzzy[next(iter(self.fuzzy))]
+                        self.fuzzy[key] = index
+
+    def suggest(self, word: str, lang: str, name: str,
+                max_distance: int = 2, limit: int = 5) -> List[str]:
+        """
+        Get the headwords closest to word within max_distance edits,
+        for when an exact lookup fails.
+        Never waits for the index: if it is not built yet, building it
+        is started and there are no suggestions this time.
+        """
+        with self.fuzzy_lock:
+            index = self.fuzzy.get((lang, name))
+        if index is None:
+            self.buildFuzzy(lang, name)
+            return []
+        return [headword for headword, _ in index.lookup(word, max_distance, limit)]
 
     def countEntries(self) -> int:
         self.c.execute("""
         SELECT COUNT(*) FROM dictionary
         """)
-        return int(self.c.fetchone()[0])
+        count = int(self.c.fetchone()[0])
+        for name, in self.conn.execute("SELECT dictname FROM attached").fetchall():
+            count += self.countEntriesDict(name)
+        self.c.execute("""
+        SELECT COUNT(*) FROM (SELECT DISTINCT dictname, headword FROM audio)
+        """)
+        return count + int(self.c.fetchone()[0])
 
     def countEntriesDict(self, name) -> int:
+        try:
+            backend = self.getBackend(name)
+        except OSError:
+            return 0
+        if backend is not None:
+            return len(backend)
+        if self.isAudioIndexed(name):
+            self.c.execute("""
+            SELECT COUNT(DISTINCT headword) FROM audio
+            WHERE dictname=?
+            """, (name,))
+            return int(self.c.fetchone()[0])
         self.c.execute("""
         SELECT COUNT(*) FROM dictionary
         WHERE dictname=?
@@ -286,20 +924,104 @@ class LocalDictionary():
         self.c.execute("""
         SELECT COUNT(DISTINCT dictname) FROM dictionary
         """)
-        return int(self.c.fetchone()[0])
+        count = int(self.c.fetchone()[0])
+        self.c.execute("""
+        SELECT (SELECT COUNT(*) FROM attached) + (SELECT COUNT(*) FROM audiolib)
+        """)
+        return count + int(self.c.fetchone()[0])
 
     def getNamesForLang(self, lang: str):
         self.c.row_factory = lambda cursor, row: row[0]
         self.c.execute("""
         SELECT DISTINCT dictname FROM dictionary
         WHERE language=?
-        """, (lang,))
+        UNION
+        SELECT dictname FROM attached
+        WHERE language=?
+        UNION
+        SELECT dictname FROM audiolib
+        WHERE language=?
+        """, (lang, lang, lang))
         res = self.c.fetchall()
         self.c.row_factory = None
         return res
 
     def purge(self):
+        with self.fts_lock:
+            self.fts_backfill = None
+        self.c.execute("""
+        DROP TABLE IF EXISTS dictionary_fts
+        """)
+        self.c.execute("""
+        DROP TABLE IF EXISTS fts_backfill
+        """)
         self.c.execute("""
         DROP TABLE IF EXISTS dictionary
         """)
+        self.c.execute("""
+        DROP TABLE IF EXISTS dictinfo
+        """)
+        self.c.execute("""
+        DROP TABLE IF EXISTS attached
+        """)
+        for table in ("audio", "audio_dirs", "audiolib"):
+            self.c.execute(f"""
+            DROP TABLE IF EXISTS {table}
+            """)
+        for name in list(self.backends):
+            self.closeBackend(name)
+        self.attached = None
+        self.clearFuzzy()
+        self.zdicts.clear()
         self.createTables()
+
+
+def _benchmark(count: int = 20000, lookups: int = 2000, seed: int = 0):
+    """
+    Measure the size of a dictionary of count generated HTML entries,
+    stored as text and compressed, and the time of a lookup in each.
+    Run with python -m vocabsieve.db [count]
+    """
+    import random
+    import tempfile
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(5000)]
+
+    def sentence(n: int) -> str:
+        return " ".join(rng.choices(vocabulary, k=n))
+
+    # Entries in the style of MDX dictionaries, with their boilerplate
+    data = {}
+    for i in range(count):
+        word = f"{rng.choice(vocabulary)}{i}"
+        senses = "".join(
+            f'<li class="sense"><span class="def">{sentence(rng.randint(5, 20))}</span>'
+            f'<div class="examples"><span class="ex">{sentence(rng.randint(5, 12))}</span></div></li>'
+            for _ in range(rng.randint(1, 4)))
+        data[word] = (f'<link rel="stylesheet" type="text/css" href="style.css"/><div class="entry">'
+                      f'<span class="hw">{word}</span> <span class="pos">{rng.choice(["noun", "verb", "adj"])}</span>'
+                      f'<ol class="senses">{senses}</ol></div>')
+    words = rng.sample(list(data), min(lookups, len(data)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for compress in (False, True):
+            dbpath = path.join(tmpdir, f"{compress}.db")
+            db = LocalDictionary(dbpath)
+            start = time.perf_counter()
+            db.importdict(data, "en", "bench", compress)
+            import_time = time.perf_counter() - start
+            db.conn.execute("VACUUM")
+            start = time.perf_counter()
+            for word in words:
+                db.define(word, "en", "bench")
+            lookup_time = (time.perf_counter() - start) / len(words)
+            # The full-text index is the same either way
+            size = db.conn.execute("SELECT SUM(LENGTH(definition)) FROM dictionary").fetchone()[0]
+            db.conn.close()
+            print(f"{'compressed' if compress else 'text'}: import {import_time:.2f} s, "
+                  f"definitions {size / 2**20:.1f} MiB, file {path.getsize(dbpath) / 2**20:.1f} MiB, "
+                  f"lookup {lookup_time * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
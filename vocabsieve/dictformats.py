@@ -1,7 +1,9 @@
 from readmdict import MDX
-from .dsl import Reader
+from .dsl import Reader, iter_entries
 from bidict import bidict
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import multiprocessing
 import os
 import re
 import csv
@@ -62,50 +64,137 @@ def dictinfo(path) -> Dict[str, str]:
         return {"type": "csv", "basename": basename, "path": path}
 
 
+class MDXStylesheet():
+    """
+    Expands the `n` style markers of MDX records into HTML.
+    The StyleSheet header lists the number, the opening HTML and the
+    closing HTML of every style, one per line. A marker opens its style,
+    which is closed before the next marker or at the end of the record.
+    Works on the UTF-8 bytes returned by readmdict, so that records are
+    decoded only once, after expansion.
+    """
+    re_marker = re.compile(rb"`(\d+)`")
+
+    def __init__(self, stylesheet: bytes):
+        self.styles: Dict[bytes, Tuple[bytes, bytes]] = {}
+        lines = stylesheet.splitlines()
+        for i in range(0, len(lines) - 2, 3):
+            self.styles[lines[i].strip()] = (lines[i + 1], lines[i + 2])
+
+    def expand(self, record: bytes) -> bytes:
+        "Apply the styles to a record and remove its newlines"
+        if self.styles and b"`" in record:
+            parts = self.re_marker.split(record)
+            styles = self.styles
+            result = [parts[0]]
+            for i in range(1, len(parts), 2):
+                begin, end = styles.get(parts[i], (b"", b""))
+                text = parts[i + 1]
+                if text.endswith(b"\n"):
+                    text = text.rstrip()
+                result.append(begin)
+                result.append(text)
+                result.append(end)
+            record = b"".join(result)
+        return record.translate(None, b"\r\n")
+
+
+def mdx_stylesheet(mdx: MDX) -> MDXStylesheet:
+    return MDXStylesheet(mdx.header.get(b'StyleSheet', b''))
+
+
 def parseMDX(path) -> Dict[str, str]:
     mdx = MDX(path)
-    stylesheet_lines = mdx.header[b'StyleSheet'].decode().splitlines()
-    stylesheet_map = {}
-    for line in stylesheet_lines:
-        if line.isnumeric():
-            number = int(line)
-        else:
-            stylesheet_map[number] = stylesheet_map.get(number, "") + line
+    stylesheet = mdx_stylesheet(mdx)
     newdict = {}  # This temporarily stores the new entries
-    i = 0
-    prev_headword = ""
-    for item in mdx.items():
-        headword, entry = item
-        headword = headword.decode()
-        entry = entry.decode()
-        # The following applies the stylesheet
-        if stylesheet_map:
-            entry = re.sub(
-                r'`(\d+)`',
-                lambda g: stylesheet_map.get(g.group().strip('`')),
-                entry
-            )
-        entry = entry.replace("\n", "").replace("\r", "")
-        # Using newdict.get would become incredibly slow,
-        # here we exploit the fact that they are alphabetically ordered
-        if prev_headword == headword:
-            newdict[headword] = newdict[headword] + entry
-        else:
-            newdict[headword] = entry
+    prev_headword = b""
+    parts: List[bytes] = []
+    for headword, entry in mdx.items():
+        # Entries spanning several records are alphabetically ordered,
+        # so the records of a headword are collected until it changes
+        if headword != prev_headword and parts:
+            newdict[prev_headword.decode()] = b"".join(parts).decode()
+            parts = []
+        parts.append(stylesheet.expand(entry))
         prev_headword = headword
+    if parts:
+        newdict[prev_headword.decode()] = b"".join(parts).decode()
     return newdict
 
 
-def parseDSL(path) -> Dict[str, str]:
+def dsl_headword(headword: str) -> str:
+    "Remove the {unsorted parts} of a DSL headword"
+    if "{" in headword:
+        headword = re.sub(r'\{[^}]+\}', "", headword)
+    return headword
+
+
+def clean_dsl_entry(definition: str) -> str:
+    "Tidy up a DSL definition converted to HTML"
+    definition = re.sub(r'(\<b\>\d+\.\</b\>)\s+\<br>', r'\1 ', definition)
+    return removeprefix(definition, "<br>")
+
+
+def split_dsl(lines: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    "Split the lines of a DSL file into chunks of at least chunk_size lines made of whole entries"
+    chunk: List[str] = []
+    last_was_text = False
+    for line in lines:
+        if not line.strip():
+            chunk.append(line)
+            continue
+        if not line.startswith((" ", "\t")):
+            # A headword after a definition starts a new entry
+            if last_was_text and len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+            last_was_text = False
+        else:
+            last_was_text = True
+        chunk.append(line)
+    if chunk:
+        yield chunk
+
+
+def parseDSLChunk(lines: List[str]) -> List[Tuple[List[str], str]]:
+    return [
+        ([dsl_headword(headword) for headword in headwords], clean_dsl_entry(definition))
+        for headwords, definition in iter_entries(lines)
+    ]
+
+
+DSL_CHUNK_LINES = 20000
+# Below this file size, starting the worker processes costs more than it saves
+DSL_PARALLEL_MIN_SIZE = 2 * 1024 * 1024
+
+
+def parseDSL(path, processes: Optional[int] = None) -> Dict[str, str]:
+    """
+    Converting the DSL markup is CPU-bound, so for large files the entries
+    are converted in a process pool, in chunks. Results are merged in file
+    order, so the output is the same as converting them one by one.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
     r = Reader()
     r.open(path)
+    chunks = split_dsl(r._iterLines(), DSL_CHUNK_LINES)
+    executor = None
+    if processes > 1 and os.path.getsize(path) >= DSL_PARALLEL_MIN_SIZE:
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(parseDSLChunk, chunks)
+    else:
+        results = map(parseDSLChunk, chunks)
     newdict = {}
-    for headwords, definition in iter(r):
-        for headword in headwords:
-            if "{" in headword:
-                headword = re.sub(r'\{[^}]+\}', "", headword)
-            definition = re.sub(r'(\<b\>\d+\.\</b\>)\s+\<br>', r'\1 ', definition)
-            newdict[headword] = removeprefix(definition, "<br>")
+    try:
+        for entries in results:
+            for headwords, definition in entries:
+                for headword in headwords:
+                    newdict[headword] = definition
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        r.close()
     return newdict
 
 
@@ -134,3 +223,58 @@ def parseTSV(path) -> Dict[str, str]:
         for row in data:
             newdict[row[0]] = row[1]
     return newdict
+
+
+def sample_dsl(count: int, seed: int = 0) -> str:
+    "Generate a Lingvo DSL dictionary of count entries, for benchmarks"
+    import random
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(5000)]
+
+    def sentence(n: int) -> str:
+        return " ".join(rng.choices(vocabulary, k=n))
+
+    parts = ['\ufeff#NAME "Benchmark"\n#INDEX_LANGUAGE "English"\n#CONTENTS_LANGUAGE "English"\n\n']
+    for i in range(count):
+        word = f"{rng.choice(vocabulary)}{i}"
+        parts.append(f"{word}\n\t[b]{word}[/b] [c gray][p]n[/p][/c]\n")
+        for n in range(1, rng.randint(2, 5)):
+            parts.append(f"\t[m1][b]{n}.[/b] [trn]{sentence(rng.randint(2, 8))}[/trn][/m]\n"
+                         f"\t[m2][*][ex][lang id=1033]{sentence(rng.randint(4, 10))}[/lang] "
+                         f"\u2014 {sentence(rng.randint(4, 10))}[/ex][/*][/m]\n"
+                         f"\t[m2][com]see [ref]{rng.choice(vocabulary)}[/ref][/com][/m]\n")
+        parts.append("\n")
+    return "".join(parts)
+
+
+def _benchmark(count: int = 20000, path: Optional[str] = None):
+    """
+    Measure converting a DSL dictionary, of count generated entries or at
+    path, on one core and in a process pool.
+    Run with python -m vocabsieve.dictformats [count | dictionary.dsl]
+    """
+    import tempfile
+    import time
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if path is None:
+            path = os.path.join(tmpdir, "bench.dsl")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(sample_dsl(count))
+        size = os.path.getsize(path)
+        results = {}
+        for processes in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            results[processes] = parseDSL(path, processes)
+            elapsed = time.perf_counter() - start
+            print(f"{processes} processes: {elapsed:.2f} s, {size / 2**20 / elapsed:.1f} MiB/s, "
+                  f"{len(results[processes])} headwords")
+        if results[1] != results[max(results)]:
+            print("The results differ")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        _benchmark(path=sys.argv[1])
+    else:
+        _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
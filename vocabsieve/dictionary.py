@@ -1,22 +1,19 @@
-import json
 import unicodedata
-import simplemma
 import re
 import requests
 import pycountry
 from urllib.parse import quote
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 from bs4 import BeautifulSoup
 from bidict import bidict
-import pymorphy2
 from markdownify import markdownify
 from markdown import markdown
 from .db import *
-from playsound import playsound
 from .forvo import *
+from .audio import play_file, play_url
 from .dictformats import removeprefix
+from .lemmatize import lem_word
 dictdb = LocalDictionary()
-langdata = simplemma.load_data('en')
 
 gtrans_languages = ['af', 'sq', 'am', 'ar', 'hy', 'az', 'eu', 'be', 'bn',
                     'bs', 'bg', 'ca', 'ceb', 'ny', 'zh', 'zh_HANT', 'co', 'hr', 'cs',
@@ -36,23 +33,8 @@ langs_supported = bidict(
 gdict_languages = [
     'en', 'hi', 'es', 'fr', 'ja', 'ru', 'de', 'it', 'ko', 'ar', 'tr', 'pt'
 ]
-simplemma_languages = [
-    'bg', 'ca', 'cy', 'da', 'de', 'en', 'es', 'et', 'fa', 'fi', 'fr', 'ga',
-    'gd', 'gl', 'gv', 'hu', 'id', 'it', 'ka', 'la', 'lb', 'lt', 'lv', 'nl',
-    'pl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sv', 'tr', 'uk', 'ur'
-]
 pronunciation_sources = ["Forvo (all)", "Forvo (best)"]
 
-# On Windows frozen build, there is no pymorphy2 support for Russian due
-# to an issue with cxfreeze
-PYMORPHY_SUPPORT = False
-try:
-    morph = pymorphy2.MorphAnalyzer(lang="ru")
-    PYMORPHY_SUPPORT = True
-except ValueError:
-    morph = None
-    pass
-
 
 def preprocess_clipboard(s: str, lang: str) -> str:
     """
@@ -105,22 +87,6 @@ def fmt_result(definitions):
     return "<br>".join(lines)
 
 
-def lem_word(word, language):
-    """Lemmatize a word. We will use PyMorphy for RU, simplemma for others,
-    and if that isn't supported , we give up."""
-    if language == 'ru' and PYMORPHY_SUPPORT:
-        return morph.parse(word)[0].normal_form
-    elif language in simplemma_languages:
-        global langdata
-        if langdata[0][0] != language:
-            langdata = simplemma.load_data(language)
-            return lem_word(word, language)
-        else:
-            return simplemma.lemmatize(word, langdata)
-    else:
-        return word
-
-
 def wiktionary(word, language, lemmatize=True) -> Optional[dict]:
     "Get definitions from Wiktionary"
     try:
@@ -157,6 +123,14 @@ def googletranslate(word, language, gtrans_lang, gtrans_api):
         return
 
 
+class WordNotFound(Exception):
+    "Raised when a lookup fails. Carries similar headwords if any were found."
+
+    def __init__(self, suggestions: Optional[List[str]] = None):
+        super().__init__("Word not found")
+        self.suggestions = suggestions or []
+
+
 def getAudio(word, language, dictionary="Forvo (all)", custom_dicts=[]) -> Optional[Dict[str, str]]:
     # should return a dict of audio names and paths to audio
     if dictionary == "Forvo (all)":
@@ -164,45 +138,53 @@ def getAudio(word, language, dictionary="Forvo (all)", custom_dicts=[]) -> Optio
     elif dictionary == "Forvo (best)":
         return fetch_audio_best(word, language)
     elif dictionary == "<all>":
-        # We are using all the local dictionaries here.
-        result = {}
-        for d in custom_dicts:
-            if d['lang'] == language and d['type'] == 'audiolib':
-                try:
-                    data = lookupin(
-                        word.lower(),
-                        language,
-                        lemmatize=False,
-                        dictionary=d['name'])
-                    if data['definition']:
-                        data['definition'] = json.loads(data['definition'])
-                        rootpath = d['path']
-                        for item in data['definition']:
-                            qualified_name = d['name'] + \
-                                ":" + os.path.splitext(item)[0]
-                            result[qualified_name] = os.path.join(
-                                rootpath, item)
-                except Exception:
-                    pass
-        return result
+        # We are using all the local audio libraries here.
+        audiolibs = [d for d in custom_dicts
+                     if d['lang'] == language and d['type'] == 'audiolib']
     else:
-        # We are using a local dictionary here.
-        data = lookupin(
-            word.lower(),
-            language,
-            lemmatize=False,
-            dictionary=dictionary)
-        data['definition'] = json.loads(data['definition'])
-        for d in custom_dicts:
-            if d['name'] == dictionary and d['lang'] == language and d['type'] == 'audiolib':
-                rootpath = d['path']
-                break
-        result = {}
-        for item in data['definition']:
-            qualified_name = dictionary + ":" + os.path.splitext(item)[0]
-            result[qualified_name] = os.path.join(rootpath, item)
-        return result
-    return
+        # We are using a local audio library here.
+        audiolibs = [d for d in custom_dicts
+                     if d['name'] == dictionary and d['lang'] == language and d['type'] == 'audiolib']
+    result = {}
+    for name, root, item in audiolib_files(word.lower(), language, audiolibs):
+        qualified_name = name + ":" + os.path.splitext(item)[0]
+        result[qualified_name] = os.path.join(root, item)
+    return result
+
+
+def audiolib_files(word: str, language: str, audiolibs: List[dict]) -> List[Tuple[str, str, str]]:
+    """
+    Find the files of word in audio libraries, as returned by dictdb.audio.
+    Libraries imported before the audio index existed are indexed on first
+    use, and libraries where a file is missing are scanned again.
+    """
+    for d in audiolibs:
+        if not dictdb.isAudioIndexed(d['name']):
+            # Replaces the file lists stored as definitions
+            dictdb.deletedict(d['name'])
+            dictdb.indexAudio(d['name'], language, d['path'])
+    names = [d['name'] for d in audiolibs]
+    files = dictdb.audio(word, language, names)
+    stale = {name for name, root, item in files
+             if not os.path.exists(os.path.join(root, item))}
+    if stale:
+        for d in audiolibs:
+            if d['name'] in stale:
+                dictdb.indexAudio(d['name'], language, d['path'])
+        files = dictdb.audio(word, language, names)
+    return files
+
+
+def lookup_candidates(word, language, lemmatize=True) -> List[str]:
+    "Get the forms of a word to try looking up, in order of preference"
+    IS_UPPER = word[0].isupper()
+    if language == 'ru':
+        word = removeAccents(word)
+    if lemmatize:
+        word = lem_word(word, language)
+    # The lemmatizer would always turn words lowercase, which can cause
+    # lookups to fail if not recovered.
+    return [word, word.capitalize()] if IS_UPPER else [word]
 
 
 def lookupin(
@@ -214,32 +196,84 @@ def lookupin(
         gtrans_api="https://lingva.ml"):
     # Remove any punctuation other than a hyphen
     # @language is code
-    IS_UPPER = word[0].isupper()
-    if language == 'ru':
-        word = removeAccents(word)
-    if lemmatize:
-        word = lem_word(word, language)
-    # The lemmatizer would always turn words lowercase, which can cause
-    # lookups to fail if not recovered.
-    candidates = [word, word.capitalize()] if IS_UPPER else [word]
+    result = lookupin_many(
+        word, language, lemmatize, [dictionary], gtrans_lang, gtrans_api)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def lookupin_many(
+        word,
+        language,
+        lemmatize=True,
+        dictionaries=["Wiktionary (English)"],
+        gtrans_lang="en",
+        gtrans_api="https://lingva.ml",
+        first_required=False) -> List[Union[dict, Exception]]:
+    """Look up a word in several dictionaries at once.
+    All the local dictionaries are resolved with a single query, or one
+    query each if it fails, so that one that fails does not hide the
+    results of the others.
+    Returns, for each dictionary, either the definition item or the
+    exception the lookup failed with. With first_required, the others
+    are not looked up when the first one fails, and only its result
+    is returned."""
+    candidates = lookup_candidates(word, language, lemmatize)
+    local = [d for d in dictionaries
+             if d not in ("Wiktionary (English)", "Google Translate")]
+    found: Dict[str, Union[Dict[str, str], Exception]] = {}
+    try:
+        found.update(dictdb.define_many(candidates, language, local))
+    except Exception:
+        for d in local:
+            try:
+                found.update(dictdb.define_many(candidates, language, [d]))
+            except Exception as e:
+                found[d] = e
+    results: List[Union[dict, Exception]] = []
+    for dictionary in dictionaries:
+        if first_required and results and isinstance(results[0], Exception):
+            break
+        if dictionary not in local:
+            try:
+                results.append(lookupin_online(
+                    candidates, language, dictionary, gtrans_lang, gtrans_api))
+            except WordNotFound as e:
+                results.append(e)
+            continue
+        definitions = found[dictionary]
+        if isinstance(definitions, Exception):
+            results.append(definitions)
+            continue
+        for candidate in candidates:
+            if candidate in definitions:
+                results.append({
+                    "word": candidate,
+                    "definition": definitions[candidate]})
+                break
+        else:
+            # Try to find what the user might have meant
+            try:
+                suggestions = dictdb.suggest(candidates[0], language, dictionary)
+            except sqlite3.Error:
+                suggestions = []
+            results.append(WordNotFound(suggestions))
+    return results
+
+
+def lookupin_online(candidates, language, dictionary, gtrans_lang, gtrans_api):
     for word in candidates:
         try:
             if dictionary == "Wiktionary (English)":
-                item = wiktionary(word, language, lemmatize)
+                item = wiktionary(word, language)
                 item['definition'] = fmt_result(item['definition'])
                 return item
             elif dictionary == "Google Translate":
                 return googletranslate(word, language, gtrans_lang, gtrans_api)
-            else:
-                return {
-                    "word": word,
-                    "definition": dictdb.define(
-                        word,
-                        language,
-                        dictionary)}
         except BaseException:
             pass
-    raise Exception("Word not found")
+    raise WordNotFound()
 
 
 def getFreq(word, language, lemfreq, dictionary) -> (int, int):
@@ -276,29 +310,19 @@ def getFreqlistsForLang(lang: str, dicts: list):
             for item in dicts if item['lang'] == lang and item['type'] == "freq"]
 
 
-forvopath = os.path.join(
-    QStandardPaths.writableLocation(
-        QStandardPaths.DataLocation), "forvo")
-
-
 def play_audio(name: str, data: dict, lang: str):
+    """
+    Start playing a pronunciation without waiting for it to be
+    downloaded or to finish. Returns the path of its file, which
+    may still be downloading.
+    """
     audiopath = data.get(name)
     if audiopath is None:
         return
-    if audiopath.startswith("https://"):
-        fpath = os.path.join(forvopath, lang, name) + audiopath[-4:]
-        if not os.path.exists(fpath):
-            res = requests.get(audiopath, headers=HEADERS)
-            if res.status_code == 200:
-                os.makedirs(os.path.dirname(fpath), exist_ok=True)
-                with open(fpath, 'bw') as file:
-                    file.write(res.content)
-            else:
-                return
-        playsound(os.path.abspath(fpath))
-        return fpath
+    if audiopath.startswith(("https://", "http://")):
+        return play_url(name, audiopath, lang)
     else:
-        playsound(os.path.abspath(audiopath))
+        play_file(audiopath)
         return audiopath
 
 
@@ -4,6 +4,7 @@ from PyQt5.QtGui import *
 from .dictionary import *
 from .tools import *
 from .dictformats import supported_dict_formats, dictinfo
+from .attached import attached_formats
 from bidict import bidict
 import json
 import os
@@ -69,7 +70,8 @@ to be reimported, otherwise this operation will fail.\
                 self.status(f"Rebuilding database: dictionary ({i+1}/{n_dicts})"
                             ".. this can take a while.")
                 QCoreApplication.processEvents()
-                dictimport(item['path'], item['type'], item['lang'], item['name'])
+                dictimport(item['path'], item['type'], item['lang'], item['name'],
+                           item.get('compress', False), item.get('attach', False))
             except Exception as e:
                 print(e)
 
@@ -187,6 +189,21 @@ class AddDictDialog(QDialog):
         self.lang.addItems(langs_supported.values())
         self.lang.setCurrentText(
             langcodes[self.settings.value("target_language")])
+        self.compress = QCheckBox("Compress definitions")
+        self.compress.setToolTip(
+            "Store definitions compressed to save disk space.\n"
+            "Lookups become slightly slower.")
+        self.compress.setEnabled(not self.audiolib)
+        self.attach = QCheckBox("Read in place (do not import)")
+        self.attach.setToolTip(
+            "Look up entries directly from the dictionary files instead of\n"
+            "copying them into the database. Adding the dictionary is almost\n"
+            "instant and takes no extra disk space, which suits very large\n"
+            "dictionaries. Full-text search is not available for them.")
+        self.attach.toggled.connect(
+            lambda checked: self.compress.setEnabled(not checked and not self.audiolib))
+        self.type.currentTextChanged.connect(self.updateAttach)
+        self.updateAttach(self.type.currentText())
         self.commit_button = QPushButton("Add")
         self.commit_button.clicked.connect(self.commit)
 
@@ -195,6 +212,8 @@ class AddDictDialog(QDialog):
         self.layout.addRow(QLabel("Name"), self.name)
         self.layout.addRow(QLabel("Type"), self.type)
         self.layout.addRow(QLabel("Language"), self.lang)
+        self.layout.addRow(self.compress)
+        self.layout.addRow(self.attach)
         self.layout.addRow(self.commit_button)
 
     def commit(self):
@@ -220,11 +239,15 @@ class AddDictDialog(QDialog):
             self.path,
             supported_dict_formats.inverse[self.type.currentText()],
             lang,
-            self.name.text())
+            self.name.text(),
+            self.compress.isChecked(),
+            self.attach.isChecked())
         dicts.append({"name": self.name.text(),
                       "type": supported_dict_formats.inverse[self.type.currentText()],
                       "path": self.path,
                       "lang": langcodes.inverse[self.lang.currentText()],
+                      "compress": self.compress.isChecked(),
+                      "attach": self.attach.isChecked(),
                       })
         self.settings.setValue("custom_dicts", json.dumps(dicts))
         self.parent.status(f"Importing {self.name.text()} to database..")
@@ -233,6 +256,12 @@ class AddDictDialog(QDialog):
         self.parent.showStats()
         self.close()
 
+    def updateAttach(self, typename):
+        attachable = supported_dict_formats.inverse[typename] in attached_formats
+        if not attachable:
+            self.attach.setChecked(False)
+        self.attach.setEnabled(attachable)
+
     def warn(self, text):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Warning)
@@ -0,0 +1,105 @@
+import gzip
+import struct
+import zlib
+from collections import OrderedDict
+from typing import List
+
+
+class DictzipFile():
+    """
+    Random access reader for dictzip (.dz) files.
+    dictzip files are gzip files compressed in independent chunks, with
+    the size of every chunk stored in the "RA" extra field of the header.
+    This allows decompressing only the chunks that hold the requested
+    range, instead of the whole file up to that point.
+    Plain gzip files without the chunk table still work, but have to be
+    decompressed from the start on every backwards seek.
+    """
+    FTEXT, FHCRC, FEXTRA, FNAME, FCOMMENT = 1, 2, 4, 8, 16
+
+    def __init__(self, path: str, cache_size: int = 32):
+        self.path = path
+        self.file = open(path, "rb")
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, bytes] = OrderedDict()
+        self.chunk_length = 0
+        self.chunk_offsets: List[int] = []
+        self.gzip = None
+        try:
+            self.readHeader()
+        except ValueError:
+            self.file.close()
+            raise
+        if not self.chunked:
+            self.file.seek(0)
+            self.gzip = gzip.GzipFile(fileobj=self.file)
+
+    @property
+    def chunked(self) -> bool:
+        "Whether the file has a chunk table, so that it can be read at random"
+        return self.chunk_length > 0 and len(self.chunk_offsets) > 1
+
+    def readHeader(self) -> None:
+        header = self.file.read(10)
+        if len(header) < 10 or header[:2] != b"\x1f\x8b":
+            raise ValueError(f"{self.path} is not a gzip file")
+        flags = header[3]
+        chunk_sizes: List[int] = []
+        if flags & self.FEXTRA:
+            xlen, = struct.unpack("<H", self.file.read(2))
+            extra = self.file.read(xlen)
+            pos = 0
+            while pos + 4 <= len(extra):
+                subfield = extra[pos:pos + 2]
+                length, = struct.unpack("<H", extra[pos + 2:pos + 4])
+                data = extra[pos + 4:pos + 4 + length]
+                if subfield == b"RA":
+                    _version, self.chunk_length, count = struct.unpack("<HHH", data[:6])
+                    chunk_sizes = list(struct.unpack(f"<{count}H", data[6:6 + count * 2]))
+                pos += 4 + length
+        for flag in (self.FNAME, self.FCOMMENT):
+            if flags & flag:
+                while self.file.read(1) not in (b"\0", b""):
+                    pass
+        if flags & self.FHCRC:
+            self.file.read(2)
+        if not chunk_sizes or self.chunk_length == 0:
+            # A plain gzip file
+            return
+        offset = self.file.tell()
+        for size in chunk_sizes:
+            self.chunk_offsets.append(offset)
+            offset += size
+        self.chunk_offsets.append(offset)
+
+    def chunk(self, n: int) -> bytes:
+        if n in self.cache:
+            self.cache.move_to_end(n)
+            return self.cache[n]
+        self.file.seek(self.chunk_offsets[n])
+        compressed = self.file.read(self.chunk_offsets[n + 1] - self.chunk_offsets[n])
+        # Chunks are flushed with Z_FULL_FLUSH, so each one is a valid
+        # raw deflate stream on its own
+        data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+        self.cache[n] = data
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return data
+
+    def read(self, offset: int, size: int) -> bytes:
+        "Read size bytes at offset of the uncompressed data"
+        if self.gzip is not None:
+            self.gzip.seek(offset)
+            return self.gzip.read(size)
+        if size <= 0:
+            return b""
+        first = offset // self.chunk_length
+        last = min((offset + size - 1) // self.chunk_length, len(self.chunk_offsets) - 2)
+        data = b"".join(self.chunk(n) for n in range(first, last + 1))
+        start = offset - first * self.chunk_length
+        return data[start:start + size]
+
+    def close(self):
+        if self.gzip is not None:
+            self.gzip.close()
+        self.file.close()
@@ -21,6 +21,7 @@
 import re
 import html
 import html.entities
+from functools import lru_cache
 from xml.sax.saxutils import escape, quoteattr
 
 from . import layer
@@ -195,6 +196,7 @@ re_m = re.compile(r"\[m(\d)\](.*?)\[/m\]")
 re_wrapped_in_quotes = re.compile("^(\\'|\")(.*)(\\1)$")
 re_end = re.compile(r"\\$")
 re_ref = re.compile("<<(.*?)>>")
+re_ex = re.compile(r"\[ex\].*?\[\/ex\]")
 
 
 # single instance of parser
@@ -208,6 +210,8 @@ def apply_shortcuts(line):
     return line
 
 
+# Dictionaries repeat many lines, such as part of speech labels
+@lru_cache(maxsize=8192)
 def _clean_tags(line, audio):
     r"""
     [m{}] => <div style="margin-left:{}em">
@@ -307,7 +311,7 @@ def _clean_tags(line, audio):
     # line = line.replace("[/ex]", "</font></span>")
 
     # SKIP EXAMPLES
-    line = re.sub(r"\[ex\].*?\[\/ex\]", "r", line)
+    line = re_ex.sub("r", line)
 
     # secondary zone
     line = line.replace("[*]", "<span class=\"sec\">")\
@@ -347,6 +351,79 @@ def unwrap_quotes(s):
     return re_wrapped_in_quotes.sub("\\2", s)
 
 
+re_tags_open = re.compile(r"(?<!\\)\[(c |[cuib]\])")
+re_tags_close = re.compile(r"\[/[cuib]\]")
+
+
+def iter_entries(lines, clean_tags=_clean_tags, audio=False):
+    """
+    Group the lines of a DSL file, without its header, into entries.
+    Yields (headwords, definition) tuples.
+    """
+    current_key = ""
+    current_key_alters = []
+    current_text = []
+    line_type = "header"
+    unfinished_line = ""
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            continue
+
+        # texts
+        if line.startswith((" ", "\t")):
+            line_type = "text"
+            line = unfinished_line + line.lstrip()
+
+            # some ill formatted source may have tags spanned into
+            # multiple lines
+            # try to match opening and closing tags
+            tags_open = re_tags_open.findall(line)
+            tags_close = re_tags_close.findall(line)
+            if len(tags_open) != len(tags_close):
+                unfinished_line = line
+                continue
+
+            unfinished_line = ""
+
+            # convert DSL tags to HTML tags
+            line = clean_tags(line, audio)
+            current_text.append(line)
+            continue
+
+        # title word(s)
+        # alternative titles
+        if line_type == "title":
+            current_key_alters.append(line)
+            continue
+
+        # previous line type is text -> start new title
+        # append previous entry
+        if line_type == "text":
+            if unfinished_line:
+                # line may be skipped if ill formatted
+                current_text.append(clean_tags(unfinished_line, audio))
+            yield (
+                [current_key] + current_key_alters,
+                "\n".join(current_text))
+
+        # start new entry
+        current_key = line
+        current_key_alters = []
+        current_text = []
+        unfinished_line = ""
+        line_type = "title"
+
+    # last entry
+    if line_type == "text":
+        if unfinished_line:
+            current_text.append(clean_tags(unfinished_line, audio))
+        yield (
+            [current_key] + current_key_alters,
+            "\n".join(current_text),
+        )
+
+
 class Reader(object):
     compressions = ("dz",)
 
@@ -354,9 +431,6 @@ class Reader(object):
     _audio: bool = False
     _only_fix_markup: bool = False
 
-    re_tags_open = re.compile(r"(?<!\\)\[(c |[cuib]\])")
-    re_tags_close = re.compile(r"\[/[cuib]\]")
-
     def __init__(self):
         self.clean_tags = _clean_tags
         self._file = None
@@ -453,66 +527,4 @@ class Reader(object):
             yield line
 
     def __iter__(self) -> "Iterator[BaseEntry]":
-        current_key = ""
-        current_key_alters = []
-        current_text = []
-        line_type = "header"
-        unfinished_line = ""
-        re_tags_open = self.re_tags_open
-        re_tags_close = self.re_tags_close
-
-        for line in self._iterLines():
-            line = line.rstrip()
-            if not line:
-                continue
-
-            # texts
-            if line.startswith((" ", "\t")):
-                line_type = "text"
-                line = unfinished_line + line.lstrip()
-
-                # some ill formatted source may have tags spanned into
-                # multiple lines
-                # try to match opening and closing tags
-                tags_open = re_tags_open.findall(line)
-                tags_close = re_tags_close.findall(line)
-                if len(tags_open) != len(tags_close):
-                    unfinished_line = line
-                    continue
-
-                unfinished_line = ""
-
-                # convert DSL tags to HTML tags
-                line = self.clean_tags(line, self._audio)
-                current_text.append(line)
-                continue
-
-            # title word(s)
-            # alternative titles
-            if line_type == "title":
-                current_key_alters.append(line)
-                continue
-
-            # previous line type is text -> start new title
-            # append previous entry
-            if line_type == "text":
-                if unfinished_line:
-                    # line may be skipped if ill formatted
-                    current_text.append(self.clean_tags(unfinished_line, self._audio))
-                yield (
-                    [current_key] + current_key_alters,
-                    "\n".join(current_text))
-
-            # start new entry
-            current_key = line
-            current_key_alters = []
-            current_text = []
-            unfinished_line = ""
-            line_type = "title"
-
-        # last entry
-        if line_type == "text":
-            yield (
-                [current_key] + current_key_alters,
-                "\n".join(current_text),
-            )
+        return iter_entries(self._iterLines(), self.clean_tags, self._audio)
@@ -19,7 +19,6 @@ exposed API lives here.
 """
 
 
-import copy
 import re
 
 from . import tag as _tag
@@ -34,12 +33,14 @@ def process_closing_tags(stack, tags):
     :param tags: Iterable[str]
     """
     index = len(stack) - 1
-    for tag in copy.copy(tags):
+    not_opened = []
+    for tag in tags:
         index_for_tag = _tag.index_of_layer_containing_tag(stack, tag)
         if index_for_tag is not None:
             index = min(index, index_for_tag)
         else:
-            tags.remove(tag)
+            not_opened.append(tag)
+    tags.difference_update(not_opened)
 
     if not tags:
         return
@@ -73,7 +74,6 @@ BRACKET_R = "\0\2"
 # precompiled regexs
 # re_m_tag_with_content = re.compile(r"(\[m\d\])(.*?)(\[/m\])")
 re_non_escaped_bracket = re.compile(r"(?<!\\)\[")
-_startswith_tag_cache = {}
 
 
 class DSLParser(object):
@@ -112,10 +112,23 @@ class DSLParser(object):
                 for t in tags
         ):
             tag_re = re.escape(tag)
-            re_tag_open = re.compile(fr"\[{tag_re}{ext_re}\]")
-            tags_.add((tag, tag_re, ext_re, re_tag_open))
+            tags_.add((tag, tag_re, ext_re))
         self.tags = frozenset(tags_)
 
+        # all opening tags in a single regex, with one named group per tag
+        self.tag_names = {}
+        alternatives = []
+        for i, (tag, tag_re, ext_re) in enumerate(sorted(self.tags)):
+            self.tag_names[f"t{i}"] = tag
+            alternatives.append(f"(?P<t{i}>{tag_re}{ext_re})")
+        self.re_tag_open = re.compile("|".join(alternatives))
+
+        openings = "|".join(f"{tag_re}{ext_re}" for _, tag_re, ext_re in self.tags)
+        closings = "|".join(tag_re for _, tag_re, _ in self.tags)
+        self.re_startswith_tag = re.compile(
+            fr"(?:(?:{openings})|/(?:{closings}))\]"
+        )
+
     def parse(self, line):
         r"""
         parse dsl markup in `line` and return clean valid dsl markup.
@@ -147,6 +160,9 @@ class DSLParser(object):
         :param line: str
         :return: Iterable
         """
+        tag_open_match = self.re_tag_open.fullmatch
+        tag_names = self.tag_names
+        Tag = _tag.Tag
         ptr = 0
         while ptr < len(line):
             bracket = line.find("[", ptr)
@@ -167,13 +183,12 @@ class DSLParser(object):
             if line[ptr + 1] == "/":
                 yield CLOSE, line[ptr + 2:bracket]
             else:
-                for tag, _, _, re_tag_open in self.tags:
-                    if re_tag_open.match(line[ptr:bracket + 1]):
-                        yield OPEN, _tag.Tag(line[ptr + 1:bracket], tag)
-                        break
+                tag = line[ptr + 1:bracket]
+                m = tag_open_match(tag) if bracket != -1 else None
+                if m:
+                    yield OPEN, Tag(tag, tag_names[m.lastgroup])
                 else:
-                    tag = line[ptr + 1:bracket]
-                    yield OPEN, _tag.Tag(tag, tag)
+                    yield OPEN, Tag(tag, tag)
             ptr = bracket + 1
 
     @staticmethod
@@ -248,31 +263,77 @@ class DSLParser(object):
 
         :rtype: str
         """
-        clean_line = ""
-        startswith_tag = _startswith_tag_cache.get(self.tags, None)
-        if startswith_tag is None:
-            openings = "|".join(f"{_[1]}{_[2]}" for _ in self.tags)
-            closings = "|".join(_[1] for _ in self.tags)
-            startswith_tag = re.compile(
-                fr"(?:(?:{openings})|/(?:{closings}))\]"
-            )
-            _startswith_tag_cache[self.tags] = startswith_tag
-        for i, chunk in enumerate(re_non_escaped_bracket.split(line)):
-            if i != 0:
-                m = startswith_tag.match(chunk)
-                if m:
-                    clean_line += "[" + \
-                        m.group() + \
-                        chunk[m.end():].replace("[", BRACKET_L)\
-                        .replace("]", BRACKET_R)
-                else:
-                    clean_line += BRACKET_L + chunk.replace("[", BRACKET_L)\
-                        .replace("]", BRACKET_R)
-            else:  # first chunk
-                clean_line += chunk.replace("[", BRACKET_L)\
-                    .replace("]", BRACKET_R)
-        return clean_line
+        startswith_tag = self.re_startswith_tag.match
+        chunks = re_non_escaped_bracket.split(line)
+        # first chunk
+        clean_line = [chunks[0].replace("[", BRACKET_L).replace("]", BRACKET_R)]
+        for chunk in chunks[1:]:
+            m = startswith_tag(chunk)
+            if m:
+                clean_line.append("[")
+                clean_line.append(m.group())
+                chunk = chunk[m.end():]
+            else:
+                clean_line.append(BRACKET_L)
+            clean_line.append(chunk.replace("[", BRACKET_L).replace("]", BRACKET_R))
+        return "".join(clean_line)
 
     @staticmethod
     def bring_brackets_back(line):
         return line.replace(BRACKET_L, "[").replace(BRACKET_R, "]")
+
+
+# Lines in the style of Lingvo dictionaries, {} is replaced by a word
+BENCHMARK_LINES = [
+    "[m1][p]n[/p] [c mediumblue]([/c][i]pl[/i] [c mediumblue]-s)[/c][/m]",
+    "[m1]\\[[t]{}[/t]\\] [s]{}.wav[/s][/m]",
+    "[m2][b]1.[/b] [trn]{}, {}[/trn][/m]",
+    "[m2][b]2.[/b] [trn][p]fig.[/p] {}; [i]{}[/i][/trn][/m]",
+    "[m3][*][ex][lang id=1033]to {} the {}[/lang] \u2014 {}[/ex][/*][/m]",
+    "[m2][b]3.[/b] [trn][c green][i]theat.[/i][/c] {}[/trn][/m]",
+    "[m1][c][i]see[/i][/c] [ref]{}[/ref][/m]",
+    "[m2][sup]1[/sup] [u]{} [b]{}[/u] {}[/b][/m]",
+]
+
+
+def benchmark(count: int = 20000, seed: int = 0):
+    """
+    Measure converting count generated lines of DSL markup, with the
+    parser alone, then with the whole conversion of a line, for new lines
+    and for lines seen before.
+    Run with python -m vocabsieve.dsl.main [count]
+    """
+    import random
+    import time
+    from . import _clean_tags
+    rng = random.Random(seed)
+    words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(5000)]
+    lines = []
+    for _ in range(count):
+        template = rng.choice(BENCHMARK_LINES)
+        lines.append(template.format(*rng.choices(words, k=template.count("{}"))))
+    parse = DSLParser().parse
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    parse_time = time.perf_counter() - start
+    _clean_tags.cache_clear()
+    start = time.perf_counter()
+    for line in lines:
+        _clean_tags(line, False)
+    convert_time = time.perf_counter() - start
+    # Dictionaries repeat lines such as part of speech labels
+    repeated = [BENCHMARK_LINES[0]] * count
+    _clean_tags.cache_clear()
+    start = time.perf_counter()
+    for line in repeated:
+        _clean_tags(line, False)
+    repeated_time = time.perf_counter() - start
+    print(f"parse: {parse_time / count * 1e6:.1f} us per line")
+    print(f"convert: {convert_time / count * 1e6:.1f} us per line")
+    print(f"convert repeated: {repeated_time / count * 1e6:.1f} us per line")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
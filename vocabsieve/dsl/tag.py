@@ -35,6 +35,7 @@ predefined = [
     "i",
     "c",
 ]
+predefined_set = frozenset(predefined)
 
 
 def was_opened(stack, tag):
@@ -45,12 +46,10 @@ def was_opened(stack, tag):
     :param tag: tag.Tag
     :return: bool
     """
-    if not len(stack):
-        return False
-    layer = stack[-1]
-    if tag in layer:
-        return True
-    return was_opened(stack[:-1], tag)
+    for layer in reversed(stack):
+        if tag in layer.tags:
+            return True
+    return False
 
 
 def canonical_order(tags):
@@ -62,14 +61,15 @@ def canonical_order(tags):
     :param tags: Iterable[Tag]
     :return: List
     """
-    result = []
-    tags = list(tags)
-    for predef in predefined:
-        t = next((t for t in tags if t.closing == predef), None)
-        if t:
-            result.append(t)
-            tags.remove(t)
-    result.extend(sorted(tags, key=lambda x: x.opening))
+    first = {}
+    rest = []
+    for t in tags:
+        if t.closing in predefined_set and t.closing not in first:
+            first[t.closing] = t
+        else:
+            rest.append(t)
+    result = [first[predef] for predef in predefined if predef in first]
+    result.extend(sorted(rest, key=lambda x: x.opening))
     return result
 
 
@@ -1 +1,7 @@
-from .server import ReaderServer
+def __getattr__(name):
+    # The server is only imported when used, so that processes converting
+    # books, which import the utils module, do not start it too
+    if name == "ReaderServer":
+        from .server import ReaderServer
+        return ReaderServer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,22 @@
-from flask import Flask, render_template, flash, request, redirect, url_for
+from flask import Flask, render_template, flash, request, redirect, url_for, jsonify, abort
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from werkzeug.utils import secure_filename
 from markdown import markdown
+import multiprocessing
 import os
-import re
+import json
+import math
+import time
+import queue
+import threading
+import atexit
+from typing import Dict, List, Optional, Tuple
 from .utils import *
+from ...known import known_words, KNOWN
+from ...dictionary import dictdb, lookup_candidates
 from PyQt5.QtCore import QStandardPaths, QCoreApplication, QObject
 from pathlib import Path
 # The following import is to avoid cxfreeze error
@@ -39,15 +50,400 @@ class Text(db.Model):  # type: ignore[name-defined]
     archived = db.Column(db.Boolean, nullable=False, default=False)
     title = db.Column(db.String(180), nullable=False)
     author = db.Column(db.String(180))
-    content = db.Column(db.Text, nullable=False)
+    # Millionths of the words read, for the library page
     progress = db.Column(db.Integer, nullable=False, default=0)
     length = db.Column(db.Integer, nullable=False)
+    # Where the reader is, as a chapter and a paragraph in it
+    chapter = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    offset = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    chapter_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    language = db.Column(db.String(10))
+    # When the definitions of its words were put in the glossary
+    prepared = db.Column(db.DateTime)
+    # Content of texts added by older versions, not split into chapters yet.
+    # Only loaded when accessed, so listing texts does not read whole books
+    body = db.relationship("TextContent", uselist=False, cascade="all, delete-orphan")
+    analysis = db.relationship("TextAnalysis", uselist=False, cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"Text(ID={self.id}, Title={self.title})"
 
 
-db.create_all()
+class TextContent(db.Model):  # type: ignore[name-defined]
+    id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    content = db.Column(db.Text, nullable=False)
+
+
+class Chapter(db.Model):  # type: ignore[name-defined]
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    content = db.Column(db.Text, nullable=False)
+    # Words in the chapters before this one, and in this one
+    start = db.Column(db.Integer, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    # Whether the paragraphs are split into sentence and word spans
+    segmented = db.Column(db.Boolean, nullable=False, default=False, server_default="0")
+    # The words of the chapter in order, separated by spaces
+    words = db.Column(db.Text)
+
+
+class TextAnalysis(db.Model):  # type: ignore[name-defined]
+    "Vocabulary of a text compared to the user's, see KnownWords.analyze"
+    id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    freq_source = db.Column(db.String(255), nullable=False)
+    # KnownWords.records() when it was analyzed
+    records = db.Column(db.String(40), nullable=False)
+    result = db.Column(db.Text, nullable=False)
+
+    @property
+    def data(self) -> dict:
+        data: dict = json.loads(self.result)
+        return data
+
+
+class GlossaryEntry(db.Model):  # type: ignore[name-defined]
+    "Definitions of a word of a prepared text, from the first and second dictionary"
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), primary_key=True)
+    word = db.Column(db.String(255), primary_key=True)
+    definition = db.Column(db.Text)
+    definition2 = db.Column(db.Text)
+    # The dictionaries they were found in
+    dictname = db.Column(db.String(255))
+    dictname2 = db.Column(db.String(255))
+
+
+# Columns added after their table, for databases created before them
+NEW_COLUMNS = [
+    ("text", "chapter", "INTEGER NOT NULL DEFAULT 0"),
+    ("text", "offset", "INTEGER NOT NULL DEFAULT 0"),
+    ("text", "chapter_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("text", "language", "VARCHAR(10)"),
+    ("chapter", "segmented", "BOOLEAN NOT NULL DEFAULT 0"),
+    ("chapter", "words", "TEXT"),
+    ("text", "prepared", "DATETIME"),
+    ("glossary_entry", "dictname", "VARCHAR(255)"),
+    ("glossary_entry", "dictname2", "VARCHAR(255)"),
+]
+
+
+class IngestJob(db.Model):  # type: ignore[name-defined]
+    "A book uploaded to be added in the background"
+    id = db.Column(db.Integer, primary_key=True)
+    added = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    filename = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(1024), nullable=False)
+    language = db.Column(db.String(10), nullable=False)
+    # queued, parsing, done or failed
+    status = db.Column(db.String(10), nullable=False, default="queued")
+    # Chapters converted so far, out of total
+    done = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    text_id = db.Column(db.Integer)
+    error = db.Column(db.Text)
+
+    def json(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "text_id": self.text_id,
+            "error": self.error
+        }
+
+
+def migrate():
+    """
+    Older versions kept the content in the text table itself. Such a
+    table is renamed away, recreated without the content column, and
+    its rows are copied over, content to the text_content table.
+    """
+    inspector = db.inspect(db.engine)
+    tables = inspector.get_table_names()
+    if "text" in tables and "content" in {column['name'] for column in inspector.get_columns("text")}:
+        db.session.execute(db.text("ALTER TABLE text RENAME TO text_legacy"))
+        db.session.commit()
+        tables.append("text_legacy")
+    db.create_all()
+    if "text_legacy" in tables:
+        db.session.execute(db.text("""
+            INSERT INTO text(added, last, id, archived, title, author, progress, length)
+            SELECT added, last, id, archived, title, author, progress, length FROM text_legacy
+            """))
+        db.session.execute(db.text("""
+            INSERT INTO text_content(id, content) SELECT id, content FROM text_legacy
+            """))
+        db.session.execute(db.text("DROP TABLE text_legacy"))
+        db.session.commit()
+    inspector = db.inspect(db.engine)
+    for table, name, definition in NEW_COLUMNS:
+        if name not in {column['name'] for column in inspector.get_columns(table)}:
+            db.session.execute(db.text(f'ALTER TABLE {table} ADD COLUMN "{name}" {definition}'))
+    db.session.commit()
+
+
+def add_chapters(text: Text, chapters: List[Tuple[str, List[str]]]):
+    "Add chapters already split into sentences and words, with their words"
+    start = 0
+    for number, (content, words) in enumerate(chapters):
+        db.session.add(Chapter(text_id=text.id, number=number, content=content,
+                               start=start, length=len(words), segmented=True,
+                               words=" ".join(words)))
+        start += len(words)
+    text.chapter_count = len(chapters)
+    text.length = start
+
+
+def split_chapters(text: Text, lang: str):
+    """
+    Split a text added by an older version, which joined the chapters
+    with 16 newlines, into chapters. Its progress, a fraction of the
+    page height, is taken as a fraction of the words instead.
+    """
+    if text.chapter_count or text.body is None:
+        return
+    add_chapters(text, [segment_html(content, text.language or lang)
+                        for content in text.body.content.split("\n" * 16)])
+    db.session.flush()
+    position = text.progress / 1_000_000 * text.length
+    chapter = Chapter.query.filter(Chapter.text_id == text.id, Chapter.start <= position)\
+        .order_by(Chapter.number.desc()).first()
+    text.chapter = chapter.number if chapter is not None else 0
+    text.offset = 0
+    db.session.delete(text.body)
+    db.session.commit()
+
+
+def chapter_words(chapter: Chapter, lang: str) -> List[str]:
+    "The words of a chapter, which are found on first use for chapters added by older versions"
+    if not chapter.segmented:
+        # Added before chapters were split into sentences on upload
+        chapter.content, words = segment_html(chapter.content, lang)
+        chapter.segmented = True
+        chapter.words = " ".join(words)
+        db.session.commit()
+    elif chapter.words is None:
+        # Added before the words were kept
+        chapter.words = " ".join(segmented_words(chapter.content))
+        db.session.commit()
+    return str(chapter.words).split()
+
+
+def analyze_text(text: Text, lang: str, freq_source: str, refresh: bool = False) -> dict:
+    """
+    The analysis of a text, which is done again if the records or the
+    frequency list changed since, or if refresh is set
+    """
+    lang = text.language or lang
+    split_chapters(text, lang)
+    known = known_words(lang)
+    records = known.records()
+    if not refresh and text.analysis is not None \
+            and (text.analysis.freq_source, text.analysis.records) == (freq_source, records):
+        analysis: TextAnalysis = text.analysis
+        return analysis.data
+    words: List[str] = []
+    # The content is only read for chapters whose words were not kept
+    for chapter in Chapter.query.filter_by(text_id=text.id).options(db.defer(Chapter.content))\
+            .order_by(Chapter.number):
+        words.extend(chapter_words(chapter, lang))
+    result = known.analyze(words, freq_source)
+    if text.analysis is None:
+        text.analysis = TextAnalysis()
+    text.analysis.freq_source = freq_source
+    text.analysis.records = records
+    text.analysis.result = json.dumps(result)
+    db.session.commit()
+    return result
+
+
+# Dictionaries that are not looked up locally, and cannot be prepared
+ONLINE_DICTIONARIES = ["<disabled>", "Wiktionary (English)", "Google Translate"]
+
+
+def glossary_candidates(word: str, lang: str) -> List[str]:
+    "Forms of a word to look for in the glossary, as a lookup would try them"
+    candidates = lookup_candidates(word, lang)
+    return candidates + [word] if word not in candidates else candidates
+
+
+def prepare_text(text: Text, lang: str, dictnames: List[str],
+                 freq_source: str = "<disabled>", known_rank: int = 0) -> dict:
+    """
+    Look up the words of a text that are not known yet in the first and
+    second dictionary ahead of time, and put their definitions in the
+    glossary of the text. Words are looked up as by lookupin: lemmatized,
+    and capitalized if they are. All the forms are looked up at once with
+    batched queries. Online dictionaries are skipped. Words are known as
+    in the reader, counting those up to known_rank of freq_source.
+    """
+    lang = text.language or lang
+    split_chapters(text, lang)
+    local = [name for name in dictnames if name not in ONLINE_DICTIONARIES]
+    words: List[str] = []
+    for chapter in Chapter.query.filter_by(text_id=text.id).options(db.defer(Chapter.content))\
+            .order_by(Chapter.number):
+        words.extend(chapter_words(chapter, lang))
+    words = list(dict.fromkeys(words))
+    known = known_words(lang)
+    known.configure(freq_source, known_rank)
+    statuses = known.statuses(words)
+    unknown = [word for word, status in zip(words, statuses) if status != KNOWN]
+    forms = {word: glossary_candidates(word, lang) for word in unknown}
+    candidates = list(dict.fromkeys(candidate for word in unknown for candidate in forms[word]))
+    found = dictdb.define_many(candidates, lang, local) if local else {}
+    entries = {}
+    # Padded for when there is no second dictionary
+    names = (dictnames + [None])[:2]
+    for candidate in candidates:
+        definitions = [found.get(name, {}).get(candidate) if name is not None else None
+                       for name in names]
+        if any(definitions):
+            entries[candidate] = {"text_id": text.id,
+                                  "word": candidate,
+                                  "definition": definitions[0],
+                                  "definition2": definitions[1],
+                                  "dictname": names[0] if definitions[0] else None,
+                                  "dictname2": names[1] if definitions[1] else None}
+    GlossaryEntry.query.filter_by(text_id=text.id).delete()
+    if entries:
+        db.session.execute(GlossaryEntry.__table__.insert(), list(entries.values()))
+    text.prepared = datetime.utcnow()
+    db.session.commit()
+    return {
+        "unknown": len(unknown),
+        "defined": sum(1 for word in unknown if any(form in entries for form in forms[word])),
+        "entries": len(entries)
+    }
+
+
+def glossary_entry(text: Text, word: str, lang: str) -> Optional[GlossaryEntry]:
+    for candidate in glossary_candidates(word, text.language or lang):
+        entry: Optional[GlossaryEntry] = GlossaryEntry.query.get((text.id, candidate))
+        if entry is not None:
+            return entry
+    return None
+
+
+migrate()
+# Texts in a page of the library
+TEXTS_PER_PAGE = 30
+# Books with fewer chapters are converted without starting processes
+INGEST_PARALLEL_MIN_CHAPTERS = 8
+# How often the progress of a job is saved, in seconds
+INGEST_PROGRESS_INTERVAL = 0.5
+ingest_queue: queue.Queue = queue.Queue()
+
+
+def ingest(job: IngestJob, processes: Optional[int] = None):
+    """
+    Add an uploaded book. Converting its chapters is CPU-bound, so for
+    books with many chapters it is done in a process pool, which returns
+    them in order. The processes are spawned, as this process has threads,
+    and only import the utils module.
+    """
+    job.status = "parsing"
+    job.done = 0
+    db.session.commit()
+    executor = None
+    try:
+        book = splitBook(job.path)
+        job.total = len(book['parts'])
+        db.session.commit()
+        args = (repeat(book['format']), book['parts'], repeat(job.language))
+        if processes != 1 and job.total >= INGEST_PARALLEL_MIN_CHAPTERS:
+            executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+            results = executor.map(convertChapter, *args)
+        else:
+            results = map(convertChapter, *args)
+        chapters = []
+        saved = time.time()
+        for result in results:
+            if result is not None:
+                chapters.append(result)
+            job.done += 1
+            if time.time() - saved > INGEST_PROGRESS_INTERVAL:
+                db.session.commit()
+                saved = time.time()
+        job.text_id = add_segmented_book(book['title'], book['author'], job.language, chapters).id
+        job.status = "done"
+    except Exception as e:
+        db.session.rollback()
+        job.status = "failed"
+        job.error = repr(e)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        db.session.commit()
+
+
+def ingest_worker():
+    "Add queued books one at a time"
+    while True:
+        job_id = ingest_queue.get()
+        with app.app_context():
+            job = IngestJob.query.get(job_id)
+            if job is not None and job.status in ("queued", "parsing"):
+                ingest(job)
+            db.session.remove()
+
+
+class ProgressBuffer():
+    """
+    Reading progress sent by the reader pages, written to the database
+    every interval seconds. Only the last position of each text is kept,
+    so scrolling through a book costs one UPDATE per text per interval,
+    which does not load the row.
+    """
+
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Held from taking the pending values until they are committed, so
+        # that older values are never written after newer ones
+        self.flush_lock = threading.Lock()
+        self.pending: Dict[int, Tuple[int, Optional[int], int]] = {}
+
+    def put(self, text_id: int, progress: float, chapter: Optional[int] = None, offset: int = 0):
+        "Progress is in millionths of the text. Raises ValueError if it is not a finite number"
+        if not math.isfinite(progress):
+            raise ValueError(f"Invalid progress: {progress}")
+        # keep values between 0 and 1 million
+        value = max(min(int(progress), 1_000_000), 0)
+        with self.lock:
+            self.pending[text_id] = (value, chapter, max(offset, 0))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return
+            with app.app_context():
+                for text_id, (progress, chapter, offset) in pending.items():
+                    values = {Text.progress: progress}
+                    if chapter is not None:
+                        values[Text.chapter] = db.func.min(
+                            db.func.max(chapter, 0), db.func.max(Text.chapter_count - 1, 0))
+                        values[Text.offset] = offset
+                    db.session.execute(db.update(Text).where(Text.id == text_id).values(values))
+                db.session.commit()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+            with app.app_context():
+                db.session.remove()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        # What is still pending when the app quits
+        atexit.register(self.flush)
+
+
+progress_buffer = ProgressBuffer()
 
 
 class ReaderServer(QObject):
@@ -59,16 +455,31 @@ class ReaderServer(QObject):
 
     def start_api(self):
         """ Main server application """
+        # Jobs interrupted by quitting are started over
+        for job in IngestJob.query.filter(IngestJob.status.in_(["queued", "parsing"])).order_by(IngestJob.id):
+            ingest_queue.put(job.id)
+        threading.Thread(target=ingest_worker, daemon=True).start()
+        progress_buffer.start()
 
         @app.route("/home")
         @app.route("/")
         def home():
-            texts = Text.query.all()
-            return render_template('home.html', texts=texts)
+            progress_buffer.flush()
+            texts = Text.query.options(db.joinedload(Text.analysis)).order_by(Text.id).paginate(
+                page=request.args.get('page', 1, type=int),
+                per_page=TEXTS_PER_PAGE,
+                error_out=False)
+            jobs = IngestJob.query.filter(IngestJob.status != "done").order_by(IngestJob.id).all()
+            return render_template('home.html', texts=texts, jobs=jobs)
+
+        def language():
+            return self.parent.settings.value("target_language", "en")
 
         @app.route("/read/<int:id>")
         def read(id):
-            text = Text.query.get(id)
+            progress_buffer.flush()
+            text = Text.query.get_or_404(id)
+            split_chapters(text, language())
             return render_template("page.html",
                                    text=text,
                                    font=self.parent.settings.value("reader_font", 'serif'),
@@ -76,37 +487,108 @@ class ReaderServer(QObject):
                                    color=self.parent.settings.value("reader_hlcolor", '#66bb77')
                                    )
 
+        @app.route("/chapter/<int:id>/<int:number>")
+        def chapter(id, number):
+            text = Text.query.get_or_404(id)
+            split_chapters(text, language())
+            chapter = Chapter.query.get_or_404((id, number))
+            words = chapter_words(chapter, text.language or language())
+            known = known_words(text.language or language())
+            known.configure(self.parent.settings.value("freq_source", "<disabled>"),
+                            self.parent.settings.value("reader_known_rank", 0, type=int))
+            return jsonify({
+                "number": chapter.number,
+                "count": text.chapter_count,
+                "start": chapter.start,
+                "length": chapter.length,
+                "content": chapter.content,
+                # One digit for each word, see KnownWords
+                "status": known.statuses(words)
+            })
+
+        @app.route("/analysis/<int:id>")
+        def analysis(id):
+            "Vocabulary of a text, analyzed again with ?refresh=true"
+            text = Text.query.get_or_404(id)
+            return jsonify(analyze_text(text, language(),
+                                        self.parent.settings.value("freq_source", "<disabled>"),
+                                        request.args.get("refresh", "false").lower() in ("1", "true")))
+
+        @app.route("/prepare/<int:id>", methods=['POST'])
+        def prepare(id):
+            "Put the definitions of the words not known yet in the glossary of a text"
+            text = Text.query.get_or_404(id)
+            dictnames = [self.parent.settings.value("dict_source", "Wiktionary (English)"),
+                         self.parent.settings.value("dict_source2", "<disabled>")]
+            if all(name in ONLINE_DICTIONARIES for name in dictnames):
+                return ("Texts can only be prepared with local dictionaries", 400)
+            return jsonify(prepare_text(text, language(), dictnames,
+                                        self.parent.settings.value("freq_source", "<disabled>"),
+                                        self.parent.settings.value("reader_known_rank", 0, type=int)))
+
+        @app.route("/glossary/<int:id>/<string:word>")
+        def glossary(id, word):
+            "Definition of a word of a prepared text"
+            text = Text.query.get_or_404(id)
+            entry = glossary_entry(text, word, language())
+            if entry is None:
+                abort(404)
+            return jsonify({
+                "word": entry.word,
+                "definition": entry.definition or "",
+                "definition2": entry.definition2,
+                "dictname": entry.dictname,
+                "dictname2": entry.dictname2
+            })
+
         @app.route("/update/<int:id>", methods=['POST'])
         def update_progress(id):
             if request.form and request.form.get('progress'):
-                # keep values between 0 and 1 million
-                prog = min(int(float(request.form.get('progress'))), 1_000_000)
-                prog = max(prog, 0)
-                text = Text.query.get(id)
-                text.progress = int(prog)
-                db.session.commit()
+                try:
+                    progress_buffer.put(id,
+                                        request.form.get('progress', type=float) or 0,
+                                        request.form.get('chapter', type=int),
+                                        request.form.get('offset', 0, type=int))
+                except ValueError:
+                    return ("bad", 400)
                 return "ok"
             return "bad"
 
+        @app.route("/progress", methods=['POST'])
+        def progress():
+            """
+            Progress of one or more texts, as a JSON object or a list of
+            them with id, progress, and optionally chapter and offset.
+            Also accepts navigator.sendBeacon, which cannot set the
+            content type.
+            """
+            data = request.get_json(force=True, silent=True)
+            updates = data if isinstance(data, list) else [data]
+            try:
+                for update in updates:
+                    progress_buffer.put(int(update['id']),
+                                        float(update['progress']),
+                                        int(update['chapter']) if update.get('chapter') is not None else None,
+                                        int(update.get('offset') or 0))
+            except (TypeError, KeyError, ValueError):
+                return ("bad", 400)
+            return ('', 204)
+
         @app.route("/upload", methods=['GET', 'POST'])
         def upload():
             if request.method == 'POST':
                 # check if the post request has the file part
                 if 'file' not in request.files:
                     if request.form.get('title') and request.form.get('text'):
-                        new_item = Text(
-                            title=request.form.get('title'),
-                            content="\n".join([
+                        add_book({
+                            "title": request.form.get('title'),
+                            "author": None,
+                            "chapters": ["\n".join([
                                 f"<p>{item}</p>"
                                 for item in
                                 request.form.get('text').splitlines()
-                            ]),
-                            length=len(
-                                re.findall(
-                                    r'\w+',
-                                    request.form.get('text'))))
-                        db.session.add(new_item)
-                        db.session.commit()
+                            ])]
+                        }, language())
                         return redirect(url_for('home'))
                     else:
                         return redirect(request.url)
@@ -119,18 +601,43 @@ class ReaderServer(QObject):
                     return redirect(request.url)
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    file.save(
-                        fpath := os.path.join(
-                            app.config['UPLOAD_FOLDER'],
-                            filename))
-                    add_book(parseBook(fpath))
+                    job = IngestJob(filename=filename, path="", language=language())
+                    db.session.add(job)
+                    db.session.flush()
+                    # Prefixed so that uploading the same name twice is safe
+                    job.path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job.id}_{filename}")
+                    file.save(job.path)
+                    db.session.commit()
+                    ingest_queue.put(job.id)
                     return redirect(url_for('home'))
                 else:
                     flash('Extension not allowed.')
             return render_template('upload.html')
 
+        @app.route("/jobs")
+        def jobs():
+            "Books being added, and those that failed"
+            return jsonify([job.json() for job in
+                            IngestJob.query.filter(IngestJob.status != "done").order_by(IngestJob.id)])
+
+        @app.route("/job/<int:id>", methods=['GET', 'DELETE'])
+        def job(id):
+            job = IngestJob.query.get_or_404(id)
+            if request.method == 'DELETE':
+                # Dismisses a failed job
+                if job.status != "failed":
+                    abort(409)
+                db.session.delete(job)
+                db.session.commit()
+                return ('', 204)
+            return jsonify(job.json())
+
         @app.route("/delete/<int:id>", methods=['DELETE'])
         def delete(id):
+            TextContent.query.filter_by(id=id).delete()
+            TextAnalysis.query.filter_by(id=id).delete()
+            GlossaryEntry.query.filter_by(text_id=id).delete()
+            Chapter.query.filter_by(text_id=id).delete()
             Text.query.filter_by(id=id).delete()
             db.session.commit()
             return ('', 204)
@@ -142,14 +649,22 @@ class ReaderServer(QObject):
             port=self.port)
 
 
-def add_book(book_obj):
-    chapters = (("\n" * 16).join(book_obj['chapters']))  # .replace(r"<h2>", r'<h2 class="title is-2">')
-    new_item = Text(title=book_obj['title'],
-                    author=book_obj['author'],
-                    content=chapters,
-                    length=len(re.findall(r'\w+', chapters)))
+def add_book(book_obj, lang: str) -> Text:
+    return add_segmented_book(book_obj['title'], book_obj['author'], lang,
+                              [segment_html(chapter, lang) for chapter in book_obj['chapters']])
+
+
+def add_segmented_book(title: str, author: Optional[str], lang: str,
+                       chapters: List[Tuple[str, List[str]]]) -> Text:
+    new_item = Text(title=title,
+                    author=author,
+                    language=lang,
+                    length=0)
     db.session.add(new_item)
+    db.session.flush()
+    add_chapters(new_item, chapters)
     db.session.commit()
+    return new_item
 
 
 if __name__ == '__main__':
@@ -1,66 +1,241 @@
 import ebooklib
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from functools import lru_cache
+from bisect import bisect_right
 from ebooklib import epub
 from charset_normalizer import from_bytes
-from lxml import etree
-from markdownify import markdownify
-from markdown import markdown
+from lxml import etree, html
+from sentence_splitter import SentenceSplitter, SentenceSplitterException
 import os
+import re
+
+# Used for languages sentence_splitter does not know
+re_sentence_end = re.compile(r'(?<=[.?!…])\s+|(?<=[。！？])')
+re_word = re.compile(r"\w+(?:['’-]\w+)*")
+re_space = re.compile(r'\s+')
 
 
 def remove_ns(s: str) -> str: return str(s).split("}")[-1]
 
 
-def fix_hyphen(s: str) -> str:
+# What tags of a book become in reader HTML. Tags mapped to None are
+# dropped with their content, tags not listed are replaced by their content
+EPUB_TAGS: Dict[str, Optional[str]] = {
+    "p": "p", "h1": "h1", "h2": "h2", "h3": "h3", "h4": "h4", "h5": "h5", "h6": "h6",
+    "blockquote": "blockquote", "ul": "ul", "ol": "ol", "li": "li", "pre": "pre",
+    "hr": "hr", "br": "br", "table": "table", "tr": "tr", "td": "td", "th": "th",
+    "em": "em", "i": "em", "strong": "strong", "b": "strong", "sub": "sub",
+    "sup": "sup", "code": "code", "s": "s",
+    "head": None, "script": None, "style": None, "img": None, "svg": None,
+    "math": None, "object": None, "iframe": None, "video": None, "audio": None
+}
+FB2_TAGS: Dict[str, Optional[str]] = {
+    "p": "p", "v": "p", "text-author": "p", "title": "h3", "subtitle": "h4",
+    "epigraph": "blockquote", "cite": "blockquote", "poem": "blockquote",
+    "table": "table", "tr": "tr", "td": "td", "th": "th",
+    "emphasis": "em", "strong": "strong", "strikethrough": "s", "sub": "sub",
+    "sup": "sup", "code": "code",
+    "empty-line": None, "image": None, "binary": None
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+# Output tags that hold text like a paragraph does
+INLINE_TAGS = {"em", "strong", "sub", "sup", "code", "s", "br"}
+# Output tags whose loose text is put into paragraphs
+CONTAINER_TAGS = {"div", "blockquote"}
+
+
+def text_of(el) -> str:
+    return " ".join("".join(el.itertext()).split())
+
+
+def title_text(el) -> str:
+    "Text of a heading, which in FB2 is made of paragraphs"
+    if any(remove_ns(child.tag) == "p" for child in el if isinstance(child.tag, str)):
+        return " ".join(text for text in map(text_of, el) if text)
+    return text_of(el)
+
+
+def add_text(out, text: str):
+    if len(out):
+        out[-1].tail = (out[-1].tail or "") + text
+    else:
+        out.text = (out.text or "") + text
+
+
+def sanitize(src, out, tags: Dict[str, Optional[str]]):
+    "Append the content of src to out, keeping only the tags in tags"
+    if src.text:
+        add_text(out, src.text)
+    for child in src:
+        sanitize_element(child, out, tags)
+        if child.tail:
+            add_text(out, child.tail)
+
+
+def sanitize_element(src, out, tags: Dict[str, Optional[str]]):
+    "Append src itself to out, without its tail"
+    if not isinstance(src.tag, str):
+        return
+    tag = remove_ns(src.tag).lower()
+    if tag not in tags:
+        sanitize(src, out, tags)
+    elif tags[tag] in HEADING_TAGS:
+        heading = etree.SubElement(out, tags[tag])
+        heading.text = title_text(src)
+    elif tags[tag] is not None:
+        sanitize(src, etree.SubElement(out, tags[tag]), tags)
+
+
+def wrap_loose_text(container):
+    """
+    Put text and inline tags that are directly in a container, such as
+    the text of a div that was replaced by its content, into paragraphs
+    """
+    for child in list(container):
+        if child.tag in CONTAINER_TAGS:
+            wrap_loose_text(child)
+    # Each block with the loose text and inline tags after it
+    runs = [(None, container.text or "", [])]
+    for child in container:
+        if child.tag in INLINE_TAGS:
+            runs[-1][2].append(child)
+        else:
+            runs.append((child, child.tail or "", []))
+    for before, text, inline in runs:
+        if not text.strip() and not any(text_of(el) for el in inline):
+            continue
+        p = etree.Element("p")
+        p.text = text.strip() if not inline else text.lstrip()
+        if before is None:
+            container.text = None
+            container.insert(0, p)
+        else:
+            before.tail = None
+            before.addnext(p)
+        for el in inline:
+            p.append(el)
+        if len(p):
+            p[-1].tail = (p[-1].tail or "").rstrip() or None
+        p.tail = "\n"
+
+
+def fix_hyphen(root):
     """This replaces first hyphen in a paragraph
     (which should not be there) with an en dash.
     """
-    return s.replace('>-', '>–')
+    for el in root.iter():
+        if el.text and el.text.startswith("-"):
+            el.text = "–" + el.text[1:]
 
 
-def tostr(s):
-    return str(
-        from_bytes(
-            etree.tostring(
-                s,
-                encoding='utf8',
-                method='text')).best()).strip()
+def parse_xml(content: bytes):
+    """
+    Parse an XML or XHTML file of a book. Its encoding is only detected
+    if it is not the one declared, or UTF-8 when it declares none
+    """
+    try:
+        return etree.fromstring(content)
+    except etree.XMLSyntaxError:
+        pass
+    try:
+        text = str(from_bytes(content).best())
+    except TypeError:
+        # No encoding fits
+        text = content.decode("utf-8", "replace")
+    parser = etree.XMLParser(encoding="utf-8", recover=True)
+    root = etree.fromstring(text.encode("utf-8"), parser)
+    if root is None:
+        # Not even recoverable as XML, such as HTML with entities XML lacks
+        root = html.document_fromstring(text)
+    return root
 
 
-def tohtml(s):
-    return str(
-        from_bytes(
-            etree.tostring(
-                s,
-                encoding='utf8')).best()).strip()
+def epubTree(content: bytes):
+    "Reader HTML of a document of an EPUB, None if it is too short to be a chapter"
+    root = etree.Element("div")
+    sanitize(parse_xml(content), root, EPUB_TAGS)
+    wrap_loose_text(root)
+    blocks = [el for el in root if text_of(el)]
+    if len(blocks) < 2:
+        return None
+    # The first line is the name of the chapter
+    if blocks[0].tag != "h2":
+        heading = etree.Element("h2")
+        heading.text = text_of(blocks[0])
+        heading.tail = "\n"
+        root.replace(blocks[0], heading)
+    fix_hyphen(root)
+    return root
 
 
-def parseEpub(path: str) -> dict:
+def fb2Tree(content: bytes):
+    "Reader HTML of a section of the body of an FB2 book"
+    root = etree.Element("div")
+    if content:
+        section = etree.fromstring(content)
+        for item in section:
+            if not isinstance(item.tag, str):
+                continue
+            if remove_ns(item.tag) == "title":
+                # The title of the section is the name of the chapter,
+                # which replaces anything before it
+                for el in list(root):
+                    root.remove(el)
+                heading = etree.SubElement(root, "h2")
+                heading.text = title_text(item)
+            else:
+                sanitize_element(item, etree.SubElement(root, "div"), FB2_TAGS)
+            root[-1].tail = "\n"
+        for div in root.findall("div"):
+            wrap_loose_text(div)
+            # Replaced by its content
+            for el in div:
+                div.addprevious(el)
+            root.remove(div)
+    fix_hyphen(root)
+    return root
+
+
+def tostring(root) -> str:
+    "Serialize the content of a tree made by the converters"
+    return (root.text or "") + "".join(
+        etree.tostring(child, encoding="unicode", method="html") for child in root)
+
+
+def epubChapter(content: bytes) -> Optional[str]:
+    "HTML of a document of an EPUB, None if it is too short to be a chapter"
+    root = epubTree(content)
+    return tostring(root) if root is not None else None
+
+
+def fb2Chapter(content: bytes) -> str:
+    "HTML of a section of the body of an FB2 book"
+    return tostring(fb2Tree(content))
+
+
+CHAPTER_CONVERTERS = {
+    "epub": epubTree,
+    "fb2": fb2Tree
+}
+
+
+def splitEpub(path: str) -> dict:
     book = epub.read_epub(path)
     title = book.get_metadata('DC', 'title') or ""
     author = book.get_metadata('DC', 'creator') or ""
-    chapters = []
-    for doc in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-        tree = etree.fromstring(doc.get_content())
-        notags = etree.tostring(tree, encoding='utf8')
-        data = markdownify(fix_hyphen(str(from_bytes(notags).best()).strip()))
-        if len(data.splitlines()) < 2:
-            continue
-        ch_name = data.splitlines()[0]
-        content = "\n".join(data.splitlines()[1:])
-        chapters.append(f"## {ch_name}\n" + content)
     return {
         "title": title[0][0],
         "author": author[0][0],
-        "chapters": [markdown(chapter) for chapter in chapters]
+        "format": "epub",
+        "parts": [doc.get_content() for doc in book.get_items_of_type(ebooklib.ITEM_DOCUMENT)]
     }
 
 
-def parseFb2(path: str) -> dict:
+def splitFb2(path: str) -> dict:
     with open(path, 'rb') as f:
         data = f.read()
-        tree = etree.fromstring(data)
-    chapters = []
+        tree = parse_xml(data)
+    parts = []
     already_seen = False
     authors = []
     title = ""
@@ -71,23 +246,63 @@ def parseFb2(path: str) -> dict:
                 if remove_ns(item.tag) == "title-info":
                     for subitem in item:
                         if remove_ns(subitem.tag) == "author":
-                            authors.append(" ".join(tostr(subitem).split()))
+                            authors.append(text_of(subitem))
                         if remove_ns(subitem.tag) == "book-title":
-                            title = tostr(subitem)
+                            title = text_of(subitem)
         if tag_nons == "body" and not already_seen:
             already_seen = True
             for section in el:
-                current_chapter = ""
-                for item in section:
-                    if remove_ns(item.tag) == "title":
-                        current_chapter = "## " + tostr(item) + "\n\n"
-                    else:
-                        current_chapter += markdownify(fix_hyphen(tohtml(item)))
-                chapters.append(current_chapter)
+                # Comments are kept as empty chapters, like empty sections
+                parts.append(etree.tostring(section) if isinstance(section.tag, str) else b"")
     return {
         "author": ", ".join(authors),
         "title": title,
-        "chapters": [markdown(chapter) for chapter in chapters]
+        "format": "fb2",
+        "parts": parts
+    }
+
+
+def splitBook(path) -> dict:
+    """
+    Read a book into its metadata and the raw parts its chapters are
+    made from, to be converted with convertChapter, in any process
+    """
+    if os.path.splitext(path)[1] == ".epub":
+        return splitEpub(path)
+    elif os.path.splitext(path)[1] == ".fb2":
+        return splitFb2(path)
+    else:
+        raise NotImplementedError("Filetype not supported")
+
+
+def convertChapter(book_format: str, part: bytes, lang: str) -> Optional[Tuple[str, List[str]]]:
+    """
+    Convert a part of a book into the HTML of a chapter split into
+    sentences and words, and its words. None if it is not a chapter
+    """
+    root = CHAPTER_CONVERTERS[book_format](part)
+    if root is None:
+        return None
+    words = segment_tree(root, lang)
+    return tostring(root), words
+
+
+def parseEpub(path: str) -> dict:
+    book = splitEpub(path)
+    chapters = [epubChapter(part) for part in book['parts']]
+    return {
+        "title": book['title'],
+        "author": book['author'],
+        "chapters": [chapter for chapter in chapters if chapter is not None]
+    }
+
+
+def parseFb2(path: str) -> dict:
+    book = splitFb2(path)
+    return {
+        "author": book['author'],
+        "title": book['title'],
+        "chapters": [fb2Chapter(part) for part in book['parts']]
     }
 
 
@@ -100,9 +315,198 @@ def parseBook(path) -> Optional[dict]:
         raise NotImplementedError("Filetype not supported")
 
 
+@lru_cache(maxsize=None)
+def sentence_splitter(lang: str) -> Optional[SentenceSplitter]:
+    try:
+        return SentenceSplitter(lang)
+    except SentenceSplitterException:
+        return None
+
+
+def split_sentences(text: str, lang: str) -> List[Tuple[int, int]]:
+    """
+    Start and end offsets of the sentences of a text.
+    sentence_splitter collapses whitespace in the sentences it returns,
+    so they are located in the text by counting the other characters.
+    """
+    splitter = sentence_splitter(lang)
+    if splitter is None:
+        sentences = re_sentence_end.split(text)
+    else:
+        sentences = splitter.split(text)
+    spans = []
+    pos = 0
+    for sentence in sentences:
+        remaining = len(re_space.sub("", sentence))
+        if remaining == 0:
+            continue
+        while text[pos].isspace():
+            pos += 1
+        start = pos
+        while remaining:
+            if not text[pos].isspace():
+                remaining -= 1
+            pos += 1
+        spans.append((start, pos))
+    return spans
+
+
+def flat_text(el) -> str:
+    "Text of an element as the sentence splitter sees it, with line breaks as newlines"
+    if el.tag == "br":
+        return "\n"
+    return (el.text or "") + "".join(flat_text(child) + (child.tail or "") for child in el)
+
+
+def append_words(container, text: str, words: List[str]):
+    "Append text to an element, with one span per word. The words are appended to words"
+    pos = 0
+    for match in re_word.finditer(text):
+        add_text(container, text[pos:match.start()])
+        word = etree.SubElement(container, "span", {"class": "w"})
+        word.text = match.group()
+        words.append(word.text)
+        pos = match.end()
+    add_text(container, text[pos:])
+
+
+def segment_inline(el, words: List[str]):
+    "Put the words inside an inline element into spans, keeping its tags"
+    if el.tag == "br":
+        return
+    text = el.text or ""
+    children = list(el)
+    for child in children:
+        el.remove(child)
+    el.text = None
+    append_words(el, text, words)
+    for child in children:
+        tail = child.tail or ""
+        child.tail = None
+        segment_inline(child, words)
+        el.append(child)
+        append_words(el, tail, words)
+
+
+def segment_paragraph(p, lang: str, words: List[str]):
+    """
+    Put the content of a paragraph into one span per sentence, each
+    holding one span per word. The words are appended to words.
+    Inline tags are kept, and line breaks separate words. A word is not
+    split across tags, so a sentence that ends inside an inline tag is
+    continued to the end of the tag.
+    """
+    # The text of the paragraph and its children, with their offsets in it
+    items: List[Tuple[int, Any]] = [(0, p.text or "")]
+    texts = [p.text or ""]
+    # Where the inline tags start and end
+    tags: List[Tuple[int, int]] = []
+    offset = len(texts[0])
+    for child in p:
+        texts += [flat_text(child), child.tail or ""]
+        items += [(offset, child), (offset + len(texts[-2]), texts[-1])]
+        tags.append((offset, offset + len(texts[-2])))
+        offset += len(texts[-2]) + len(texts[-1])
+    sentences: List[List[int]] = []
+    for start, end in split_sentences("".join(texts), lang):
+        for tag_start, tag_end in tags:
+            if tag_start < start < tag_end:
+                start = tag_start
+            if tag_start < end < tag_end:
+                end = tag_end
+        if sentences and start < sentences[-1][1]:
+            sentences[-1][1] = max(end, sentences[-1][1])
+        else:
+            sentences.append([start, end])
+    starts = [start for start, _ in sentences]
+
+    def sentence_at(pos: int) -> Optional[int]:
+        i = bisect_right(starts, pos) - 1
+        return i if i >= 0 and pos < sentences[i][1] else None
+
+    for _, item in items[1:]:
+        if not isinstance(item, str):
+            item.tail = None
+            p.remove(item)
+    p.text = None
+    container, current = p, None
+    cuts = sorted({pos for sentence in sentences for pos in sentence})
+    for item_start, item in items:
+        if isinstance(item, str):
+            pieces = [item_start] + [cut for cut in cuts if item_start < cut < item_start + len(item)]
+            bounds = list(zip(pieces, pieces[1:] + [item_start + len(item)]))
+        else:
+            bounds = [(item_start, item_start)]
+        for start, end in bounds:
+            i = sentence_at(start)
+            if i != current:
+                current = i
+                container = p if i is None else etree.SubElement(p, "span", {"class": "sentence"})
+            if isinstance(item, str):
+                append_words(container, item[start - item_start:end - item_start], words)
+            else:
+                segment_inline(item, words)
+                container.append(item)
+
+
+def segment_tree(root, lang: str) -> List[str]:
+    "Split the paragraphs of a tree into sentences and words. Returns the words in order"
+    words: List[str] = []
+    for p in root.iter("p"):
+        segment_paragraph(p, lang, words)
+    return words
+
+
+def segment_html(content: str, lang: str) -> Tuple[str, List[str]]:
+    """
+    Split the paragraphs of a chapter into sentences and words once, so
+    that the reader page does not have to. Returns the new HTML and the
+    words in it, in order
+    """
+    root = html.fragment_fromstring(content, create_parent="div")
+    words = segment_tree(root, lang)
+    return tostring(root), words
+
+
+def segmented_words(content: str) -> List[str]:
+    "The words of a chapter that is already segmented, in order"
+    if not content.strip():
+        return []
+    words: List[str] = html.fragment_fromstring(content, create_parent="div").xpath('//span[@class="w"]/text()')
+    return words
+
+
 ALLOWED_EXTENSIONS = {'epub', 'fb2'}
 
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def _benchmark(paths: List[str]):
+    """
+    Measure converting books into the HTML of the reader.
+    Run with python -m vocabsieve.ext.reader.utils book.epub book.fb2...
+    """
+    import time
+    total_size = 0
+    total_time = 0.0
+    for path in paths:
+        start = time.perf_counter()
+        book = parseBook(path)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+        total_size += size
+        total_time += elapsed
+        chapters = len(book['chapters']) if book else 0
+        print(f"{os.path.basename(path)}: {size / 2**20:.1f} MiB, {chapters} chapters, {elapsed:.3f} s")
+    if total_time:
+        print(f"total: {total_time:.2f} s, {total_size / 2**20 / total_time:.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m vocabsieve.ext.reader.utils book.epub book.fb2...")
+    _benchmark(sys.argv[1:])
@@ -1,22 +1,31 @@
 from __future__ import annotations
-from bs4 import BeautifulSoup
-from typing import List, Dict
+from lxml import etree
+from typing import List, Dict, Optional
 import requests
-from playsound import PlaysoundException, playsound
 from os import path
 import os
 import re
+import json
+import time
 import base64
+import sqlite3
+import threading
 from PyQt5.QtCore import QStandardPaths, QCoreApplication
 from pathlib import Path
 from urllib.parse import quote, unquote
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from .audio import HEADERS, prefetch_audio
 
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
 datapath = QStandardPaths.writableLocation(QStandardPaths.DataLocation)
 Path(path.join(datapath, "_forvo")).mkdir(parents=True, exist_ok=True)
 
+# Can be pointed elsewhere, e.g. to a local server for testing
+FORVO_URL = "https://forvo.com/word/"
+FORVO_AUDIO_URL = "https://audio00.forvo.com/"
+# How long the pronunciations found for a word are reused before
+# checking Forvo again for new ones
+CACHE_TTL = 7 * 24 * 60 * 60
+
 
 @dataclass
 class Pronunciation:
@@ -30,9 +39,49 @@ class Pronunciation:
     id: int
 
 
+def contents(el) -> list:
+    "Child nodes of an element, text included, like BeautifulSoup's contents"
+    result = [el.text] if el.text else []
+    for child in el:
+        result.append(child)
+        if child.tail:
+            result.append(child.tail)
+    return result
+
+
+def has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Compiled once, each is evaluated in a single pass over its element
+XPATH_NS = {"re": "http://exslt.org/regular-expressions"}
+xp_lang_containers = etree.XPath(
+    r"//*[re:test(@id, 'language-container-\w{2,4}')]", namespaces=XPATH_NS)
+xp_pronunciation_items = etree.XPath(
+    f"(((.//*[{has_class('pronunciations')}])[1]"
+    f"//*[{has_class('show-all-pronunciations')}])[1]//li)")
+xp_first_span = etree.XPath("(.//span)[1]")
+xp_has_more = etree.XPath(f"boolean(.//*[{has_class('more')}])")
+xp_onclick = etree.XPath(
+    r"(.//*[re:test(@id, 'play_\d+')])[1]/@onclick", namespaces=XPATH_NS)
+main_actions_path = f"((.//*[{has_class('more')}])[1]//*[{has_class('main_actions')}])[1]"
+xp_vote_span = etree.XPath(
+    f"(({main_actions_path}//*[re:test(@id, 'word_rate_\\d+')])[1]"
+    f"//*[{has_class('num_votes')}])[1]//span", namespaces=XPATH_NS)
+xp_data_id = etree.XPath(f"({main_actions_path}//*[{has_class('share')}])[1]/@data-id")
+xp_username = etree.XPath(f"./*[{has_class('ofLink')}]")
+
+re_lang_container = re.compile(r"language-container-(\w{2,4})")
+re_headword = re.compile("(.*)pronunciation$", re.S)
+re_votes = re.compile(r"(-?\d+).*")
+re_mp3 = re.compile(r"Play\(\d+,'.+','.+',\w+,'([^']+)")
+re_ogg = re.compile(r"Play\(\d+,'[^']+','([^']+)")
+re_username = re.compile("Pronunciation by(.*)", re.S)
+
+
 class Forvo:
     def __init__(self, word, lang):
-        self.url = "https://forvo.com/word/" + quote(word)
+        self.url = FORVO_URL + quote(word)
         self.pronunciations: List[Pronunciation] = []
         self.session = requests.Session()
         self.language = lang
@@ -43,116 +92,170 @@ class Forvo:
             page = res.text
         else:
             raise Exception("failed to fetch forvo page")
-        html = BeautifulSoup(page, "lxml")
-        available_langs_els = html.find_all(
-            id=re.compile(r"language-container-\w{2,4}"))
-        available_langs = [
-            re.findall(
-                r"language-container-(\w{2,4})",
-                el.attrs["id"])[0] for el in available_langs_els]
-        if self.language not in available_langs:
-            return self
-
-        lang_container = [
-            lang for lang in available_langs_els if re.findall(
-                r"language-container-(\w{2,4})",
-                lang.attrs["id"])[0] == self.language][0]
-        pronunciations_els = lang_container.find_all(class_="pronunciations")
-        pronunciation_items = pronunciations_els[0].find_all(
-            class_="show-all-pronunciations")[0].find_all("li")
+        self.pronunciations.extend(self.parse(page))
+        return self
+
+    def parse(self, page: str) -> List[Pronunciation]:
+        "Extract the pronunciations in self.language from a word page"
+        html = etree.HTML(page)
+        if html is None:
+            return []
+        lang_container = None
+        for el in xp_lang_containers(html):
+            m = re_lang_container.search(el.get("id"))
+            if m is not None and m.group(1) == self.language:
+                lang_container = el
+                break
+        if lang_container is None:
+            return []
+
+        pronunciation_items = xp_pronunciation_items(lang_container)
         word = self.url.rsplit('/', 2)[-2]
-        headword_el = pronunciation_items[0].find_all('span')[0]
-        headword = re.findall(
-            "(.*)pronunciation$",
-            headword_el.contents[0],
-            re.S)[0].strip().replace(
-            "/",
-            "[SLASH]")
+        headword_el = xp_first_span(pronunciation_items[0])[0]
+        headword = re_headword.findall(
+            contents(headword_el)[0])[0].strip().replace("/", "[SLASH]")
         if not headword:
             headword = '--ERROR--'
+        pronunciations = []
         for pronunciation_item in pronunciation_items:
-            if len(pronunciation_item.find_all(class_="more")) == 0:
+            if not xp_has_more(pronunciation_item):
                 continue
-            pronunciation_dls = re.findall(
-                r"Play\(\d+,'.+','.+',\w+,'([^']+)",
-                pronunciation_item.find_all(
-                    id=re.compile(r"play_\d+"))[0].attrs["onclick"])
-            vote_count = pronunciation_item.find_all(class_="more")[0].find_all(
-                class_="main_actions")[0].find_all(
-                id=re.compile(r"word_rate_\d+"))[0].find_all(class_="num_votes")[0]
-            vote_count_inner_span = vote_count.find_all("span")
+            onclick = xp_onclick(pronunciation_item)[0]
+            vote_count_inner_span = xp_vote_span(pronunciation_item)
             if len(vote_count_inner_span) == 0:
                 vote_count = 0
             else:
-                vote_count = int(
-                    str(re.findall(r"(-?\d+).*", vote_count_inner_span[0].contents[0])[0]))
-            pronunciation_dls = re.findall(
-                r"Play\(\d+,'.+','.+',\w+,'([^']+)",
-                pronunciation_item.find_all(
-                    id=re.compile(r"play_\d+"))[0].attrs["onclick"])
+                vote_count = int(re_votes.findall(contents(vote_count_inner_span[0])[0])[0])
+            pronunciation_dls = re_mp3.findall(onclick)
             is_ogg = False
             if len(pronunciation_dls) == 0:
-                pronunciation_dl = re.findall(
-                    r"Play\(\d+,'[^']+','([^']+)",
-                    pronunciation_item.find_all(
-                        id=re.compile(r"play_\d+"))[0].attrs["onclick"])[0]
-                dl_url = "https://audio00.forvo.com/ogg/" + \
+                pronunciation_dl = re_ogg.findall(onclick)[0]
+                dl_url = FORVO_AUDIO_URL + "ogg/" + \
                     str(base64.b64decode(pronunciation_dl), "utf-8")
                 is_ogg = True
             else:
                 pronunciation_dl = pronunciation_dls[0]
-                dl_url = "https://audio00.forvo.com/audios/mp3/" + \
+                dl_url = FORVO_AUDIO_URL + "audios/mp3/" + \
                     str(base64.b64decode(pronunciation_dl), "utf-8")
-            data_id = int(
-                pronunciation_item.find_all(
-                    class_="more")[0].find_all(
-                    class_="main_actions")[0].find_all(
-                    class_="share")[0].attrs["data-id"])
-            username = pronunciation_item.find_all(
-                class_="ofLink", recursive=False)
+            data_id = int(xp_data_id(pronunciation_item)[0])
+            username = xp_username(pronunciation_item)
             if len(username) == 0:
-                username = re.findall(
-                    "Pronunciation by(.*)",
-                    pronunciation_item.contents[2],
-                    re.S)[0].strip()
+                username = re_username.findall(contents(pronunciation_item)[2])[0].strip()
             else:
-                username = username[0].contents[0]
+                username = contents(username[0])[0]
             origin = username
-            pronunciation_object = Pronunciation(self.language,
-                                                 headword,
-                                                 word,
-                                                 vote_count,
-                                                 origin,
-                                                 dl_url,
-                                                 is_ogg,
-                                                 data_id,
-                                                 )
-
-            self.pronunciations.append(pronunciation_object)
-        return self
+            pronunciations.append(Pronunciation(self.language,
+                                                headword,
+                                                word,
+                                                vote_count,
+                                                origin,
+                                                dl_url,
+                                                is_ogg,
+                                                data_id,
+                                                ))
+        return pronunciations
+
+
+class PronunciationCache():
+    "Pronunciations found on Forvo, by word and language"
+
+    def __init__(self, dbpath: str, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbpath, check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS pronunciations (
+            word TEXT,
+            language TEXT,
+            timestamp FLOAT,
+            data TEXT,
+            PRIMARY KEY (word, language)
+        )
+        """)
+        self.conn.commit()
+
+    def get(self, word: str, lang: str) -> Optional[List[Pronunciation]]:
+        "Cached pronunciations, or None if there are none or they expired"
+        with self.lock:
+            row = self.conn.execute("""
+            SELECT timestamp, data FROM pronunciations
+            WHERE word=? AND language=?
+            """, (word, lang)).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return [Pronunciation(**item) for item in json.loads(row[1])]
+
+    def put(self, word: str, lang: str, pronunciations: List[Pronunciation]):
+        with self.lock:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO pronunciations(word, language, timestamp, data)
+            VALUES(?, ?, ?, ?)
+            """, (word, lang, time.time(), json.dumps([asdict(item) for item in pronunciations])))
+            self.conn.commit()
+
+
+cache = PronunciationCache(path.join(datapath, "_forvo", "cache.db"))
+
+
+def get_pronunciations(word: str, lang: str) -> List[Pronunciation]:
+    "Pronunciations of a word from the cache, or else from Forvo"
+    pronunciations = cache.get(word, lang)
+    if pronunciations is None:
+        pronunciations = Forvo(word, lang).get_pronunciations().pronunciations
+        # Words without pronunciations are cached too
+        cache.put(word, lang, pronunciations)
+    return pronunciations
 
 
 def fetch_audio_all(word: str, lang: str) -> Dict[str, str]:
-    sounds = Forvo(word, lang).get_pronunciations().pronunciations
+    sounds = get_pronunciations(word, lang)
     if len(sounds) == 0:
         return {}
     result = {}
     for item in sounds:
         result[item.origin + "/" + item.headword] = item.download_url
+    best = max(sounds, key=lambda x: x.votes)
+    prefetch_audio(best.origin + "/" + best.headword, best.download_url, lang)
     return result
 
 
 def fetch_audio_best(word: str, lang: str) -> Dict[str, str]:
-    sounds = Forvo(word, lang).get_pronunciations().pronunciations
+    sounds = get_pronunciations(word, lang)
     if len(sounds) == 0:
         return {}
     sounds = sorted(sounds, key=lambda x: x.votes, reverse=True)
+    prefetch_audio(sounds[0].origin + "/" + sounds[0].headword, sounds[0].download_url, lang)
     return {
         sounds[0].origin +
         "/" +
         sounds[0].headword: sounds[0].download_url}
 
 
+def _benchmark(paths: List[str], repeat: int = 200):
+    """
+    Measure parsing saved word pages, for every language they have.
+    Run with python -m vocabsieve.forvo page.html...
+    """
+    parses = 0
+    elapsed = 0.0
+    for page_path in paths:
+        with open(page_path, encoding="utf-8") as f:
+            page = f.read()
+        word = path.splitext(path.basename(page_path))[0]
+        for lang in re_lang_container.findall(page):
+            forvo = Forvo(word, lang)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                forvo.parse(page)
+            elapsed += time.perf_counter() - start
+            parses += repeat
+    print(f"{parses // repeat} pages and languages, {elapsed / parses * 1000:.2f} ms per parse")
+
+
 if __name__ == "__main__":
-    print(fetch_audio_all("what", "en"))
-    print(fetch_audio_best("goodbye", "en"))
+    import sys
+    if len(sys.argv) > 1:
+        _benchmark(sys.argv[1:])
+    else:
+        print(fetch_audio_all("what", "en"))
+        print(fetch_audio_best("goodbye", "en"))
@@ -0,0 +1,147 @@
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance between two strings.
+    Gives up early and returns max_distance + 1 as soon as the
+    distance is known to exceed max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            value = min(
+                prev[j] + 1,
+                cur[j - 1] + 1,
+                prev[j - 1] + (a[i - 1] != b[j - 1])
+            )
+            # Transposition of two adjacent characters
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev2[j - 2] + 1)
+            cur[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    "All strings obtainable by deleting up to max_distance characters"
+    result = {word}
+    edge = {word}
+    for _ in range(max_distance):
+        new_edge = set()
+        for item in edge:
+            for i in range(len(item)):
+                new_edge.add(item[:i] + item[i + 1:])
+        new_edge -= result
+        result |= new_edge
+        edge = new_edge
+    return result
+
+
+class SymSpell():
+    """
+    Symmetric delete index for approximate headword matching.
+    Every headword is stored under all of its deletion variants, so that
+    candidates for a query can be found by generating the deletion variants
+    of the query only, instead of comparing it to every headword.
+    As in the original SymSpell algorithm, only the first prefix_length
+    characters are used for the variants to keep the index small.
+    """
+
+    def __init__(self, words: Iterable[str], max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words: List[str] = []
+        # A single int for the common case of one headword per variant,
+        # which saves allocating a list for most of the entries.
+        self.index: Dict[str, Union[int, List[int]]] = {}
+        seen: Set[str] = set()
+        for word in words:
+            if not word or word in seen:
+                continue
+            seen.add(word)
+            n = len(self.words)
+            self.words.append(word)
+            for variant in deletes(word.lower()[:prefix_length], max_distance):
+                existing = self.index.get(variant)
+                if existing is None:
+                    self.index[variant] = n
+                elif isinstance(existing, int):
+                    self.index[variant] = [existing, n]
+                else:
+                    existing.append(n)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def lookup(self, word: str, max_distance: int = -1, limit: int = 5) -> List[Tuple[str, int]]:
+        """Find the headwords closest to word, as a list of
+        (headword, distance) tuples, closest first."""
+        if max_distance < 0 or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        query = word.lower()
+        candidates: Set[int] = set()
+        for variant in deletes(query[:self.prefix_length], max_distance):
+            found = self.index.get(variant)
+            if found is None:
+                continue
+            if isinstance(found, int):
+                candidates.add(found)
+            else:
+                candidates.update(found)
+        results = []
+        for n in candidates:
+            candidate = self.words[n]
+            distance = edit_distance(query, candidate.lower(), max_distance)
+            if distance <= max_distance:
+                results.append((candidate, distance))
+        results.sort(key=lambda x: (x[1], abs(len(x[0]) - len(word)), x[0]))
+        return results[:limit]
+
+
+def benchmark(count: int = 100000, queries: int = 1000, seed: int = 0):
+    """
+    Measure building an index of count random headwords, its memory use,
+    and the time of a lookup. Run with python -m vocabsieve.fuzzy [count]
+    """
+    import random
+    import string
+    import time
+    import tracemalloc
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12))) for _ in range(count)]
+    start = time.perf_counter()
+    index = SymSpell(words)
+    build_time = time.perf_counter() - start
+    del index
+    # Measured separately, tracing makes the build much slower
+    tracemalloc.start()
+    index = SymSpell(words)
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Misspell existing headwords by one or two edits
+    typos = []
+    for word in rng.sample(words, min(queries, len(words))):
+        for _ in range(rng.randint(1, 2)):
+            i = rng.randrange(len(word))
+            word = word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+        typos.append(word)
+    start = time.perf_counter()
+    for typo in typos:
+        index.lookup(typo)
+    lookup_time = (time.perf_counter() - start) / len(typos)
+    print(f"{len(index)} headwords, {len(index.index)} variants")
+    print(f"build: {build_time:.2f} s")
+    print(f"memory: {memory / 2**20:.1f} MiB, {peak / 2**20:.1f} MiB at peak")
+    print(f"lookup: {lookup_time * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,220 @@
+"""
+Words the user knows or is learning, from the notes they mined, the
+words they looked up and frequency lists. Used to colour words in the
+reader and to analyze how much of a book the user can understand.
+"""
+import multiprocessing
+import os
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+from os import path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .db import datapath
+from .dictionary import dictdb
+from .lemmatize import lem_word, lemmatize_many
+
+# Status of a word, one digit each so that a chapter is sent as a string
+UNKNOWN = "0"
+LEARNING = "1"
+KNOWN = "2"
+# Coverage of a text is given for the words up to these ranks of the frequency list
+COVERAGE_RANKS = [1000, 2000, 5000, 10000, 20000]
+# Fewer distinct words are lemmatized without starting processes
+ANALYSIS_PARALLEL_MIN_WORDS = 5000
+
+
+def frequency_ranks(lang: str, freq_source: str) -> Dict[str, int]:
+    "The rank of each word of a frequency list"
+    ranks: Dict[str, int] = {}
+    if freq_source == "<disabled>":
+        return ranks
+    conn = sqlite3.connect(path.join(datapath, "dict.db"))
+    try:
+        for word, definition in conn.execute(
+                "SELECT word, definition FROM dictionary WHERE language=? AND dictname=?",
+                (lang, freq_source)):
+            try:
+                rank = int(dictdb.decompress(freq_source, definition))
+            except ValueError:
+                continue
+            word = word.lower()
+            ranks[word] = min(rank, ranks.get(word, rank))
+    finally:
+        conn.close()
+    return ranks
+
+
+class KnownWords():
+    """
+    Sets of known and learning words of a language, with their lemmas.
+    A word is known if a note was mined for it or if it is among the
+    most frequent words of a frequency list, and learning if it was
+    looked up. Notes do not record their language, so they count for
+    every language.
+    The sets are built once and then only read the rows added since,
+    unless rows were deleted, in which case they are built again.
+    """
+
+    def __init__(self, lang: str):
+        self.lang = lang
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path.join(datapath, "records.db"), check_same_thread=False)
+        self.known: Set[str] = set()
+        self.learning: Set[str] = set()
+        self.frequent: Set[str] = set()
+        # Last rows of the notes and lookups tables read
+        self.last: Dict[str, int] = {"notes": 0, "lookups": 0}
+        self.freq: Tuple[str, int] = ("<disabled>", 0)
+        self.lemmas: Dict[str, str] = {}
+
+    def lemma(self, word: str) -> str:
+        lemma = self.lemmas.get(word)
+        if lemma is None:
+            lemma = self.lemmas[word] = lem_word(word, self.lang).lower()
+        return lemma
+
+    def add(self, words: Set[str], new: Iterable[Tuple[str]]):
+        for word, in new:
+            word = (word or "").strip().lower()
+            if word:
+                words.add(word)
+                words.add(self.lemma(word))
+
+    def refresh(self):
+        "Read the notes and lookups added since the last refresh"
+        try:
+            last = {
+                "notes": self.conn.execute("SELECT MAX(rowid) FROM notes").fetchone()[0] or 0,
+                "lookups": self.conn.execute("SELECT MAX(rowid) FROM lookups").fetchone()[0] or 0
+            }
+        except sqlite3.OperationalError:
+            # No records yet
+            return
+        if any(last[table] < self.last[table] for table in last):
+            self.known, self.learning = set(), set()
+            self.last = {"notes": 0, "lookups": 0}
+        if last["notes"] > self.last["notes"]:
+            self.add(self.known, self.conn.execute(
+                "SELECT word FROM notes WHERE rowid > ? AND rowid <= ?",
+                (self.last["notes"], last["notes"])))
+        if last["lookups"] > self.last["lookups"]:
+            self.add(self.learning, self.conn.execute(
+                "SELECT word FROM lookups WHERE rowid > ? AND rowid <= ? AND language=? AND success",
+                (self.last["lookups"], last["lookups"], self.lang)))
+        self.last = last
+
+    def records(self) -> str:
+        "How far the records were read, which changes whenever they do"
+        with self.lock:
+            self.refresh()
+            return f"{self.last['notes']}:{self.last['lookups']}"
+
+    def configure(self, freq_source: str, rank: int):
+        "Count the words of a frequency list up to rank as known"
+        if (freq_source, rank) == self.freq:
+            return
+        frequent: Set[str] = set()
+        if rank > 0:
+            frequent = {word for word, word_rank in frequency_ranks(self.lang, freq_source).items()
+                        if word_rank <= rank}
+        with self.lock:
+            self.frequent = frequent
+            self.freq = (freq_source, rank)
+
+    def status(self, word: str) -> str:
+        word = word.lower()
+        if any(c.isdigit() for c in word):
+            return KNOWN
+        forms = (word, self.lemma(word))
+        if any(form in self.known or form in self.frequent for form in forms):
+            return KNOWN
+        if any(form in self.learning for form in forms):
+            return LEARNING
+        return UNKNOWN
+
+    def statuses(self, words: List[str]) -> str:
+        "The status of each word, as a string of digits"
+        with self.lock:
+            self.refresh()
+            # Each distinct word is only looked at once
+            cache: Dict[str, str] = {}
+            for word in set(words):
+                cache[word] = self.status(word)
+            return "".join([cache[word] for word in words])
+
+    def analyze(self, words: List[str], freq_source: str, processes: Optional[int] = None) -> dict:
+        """
+        How much of a text made of words is covered by the user's
+        vocabulary and by a frequency list, as shares of the words of the
+        text. Numbers are left out. The distinct words are lemmatized in
+        a process pool when there are many of them.
+        """
+        counts = Counter(word.lower() for word in words if not any(c.isdigit() for c in word))
+        with self.lock:
+            self.refresh()
+            todo = [word for word in counts if word not in self.lemmas]
+        processes = processes or os.cpu_count() or 1
+        if processes > 1 and len(todo) >= ANALYSIS_PARALLEL_MIN_WORDS:
+            # A few chunks per process, so that they finish close together.
+            # Processes are spawned rather than forked from this threaded
+            # process, and only import the lemmatize module.
+            size = -(-len(todo) // (4 * processes))
+            with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+                parts = executor.map(lemmatize_many,
+                                     [todo[i:i + size] for i in range(0, len(todo), size)],
+                                     repeat(self.lang))
+                lemmas = [lemma for part in parts for lemma in part]
+        else:
+            lemmas = lemmatize_many(todo, self.lang)
+        ranks = frequency_ranks(self.lang, freq_source)
+        mined = looked_up = in_list = 0
+        unknown_lemmas: Set[str] = set()
+        covered = [0] * len(COVERAGE_RANKS)
+        with self.lock:
+            self.lemmas.update(zip(todo, lemmas))
+            for word, count in counts.items():
+                forms = (word, self.lemmas[word])
+                if any(form in self.known for form in forms):
+                    mined += count
+                elif any(form in self.learning for form in forms):
+                    looked_up += count
+                else:
+                    unknown_lemmas.add(forms[1])
+                rank = min((ranks[form] for form in forms if form in ranks), default=None)
+                if rank is not None:
+                    in_list += count
+                    for i, limit in enumerate(COVERAGE_RANKS):
+                        if rank <= limit:
+                            covered[i] += count
+            lemma_count = len({self.lemmas[word] for word in counts})
+        words_count = sum(counts.values())
+        total = max(words_count, 1)
+        return {
+            "analyzed": datetime.utcnow().isoformat(timespec="seconds"),
+            "words": words_count,
+            "unique_words": len(counts),
+            "unique_lemmas": lemma_count,
+            "mined": mined / total,
+            "looked_up": looked_up / total,
+            "unknown_lemmas": len(unknown_lemmas),
+            "frequency": {
+                "source": freq_source if ranks else None,
+                "listed": in_list / total,
+                "coverage": {str(limit): covered[i] / total for i, limit in enumerate(COVERAGE_RANKS)}
+            }
+        }
+
+
+_known_words: Dict[str, KnownWords] = {}
+_known_words_lock = threading.Lock()
+
+
+def known_words(lang: str) -> KnownWords:
+    with _known_words_lock:
+        if lang not in _known_words:
+            _known_words[lang] = KnownWords(lang)
+        return _known_words[lang]
@@ -0,0 +1,50 @@
+"""
+Lemmatization of words. This module has no side effects when imported
+and does not use Qt or the databases, so that processes lemmatizing
+words in parallel can import it.
+"""
+from typing import List
+import simplemma
+
+simplemma_languages = [
+    'bg', 'ca', 'cy', 'da', 'de', 'en', 'es', 'et', 'fa', 'fi', 'fr', 'ga',
+    'gd', 'gl', 'gv', 'hu', 'id', 'it', 'ka', 'la', 'lb', 'lt', 'lv', 'nl',
+    'pl', 'pt', 'ro', 'ru', 'sk', 'sl', 'sv', 'tr', 'uk', 'ur'
+]
+
+# Loaded on first use
+langdata = None
+morph = None
+# On Windows frozen build, there is no pymorphy2 support for Russian due
+# to an issue with cxfreeze. None until it is tried.
+PYMORPHY_SUPPORT = None
+
+
+def pymorphy_support() -> bool:
+    global morph, PYMORPHY_SUPPORT
+    if PYMORPHY_SUPPORT is None:
+        try:
+            import pymorphy2
+            morph = pymorphy2.MorphAnalyzer(lang="ru")
+            PYMORPHY_SUPPORT = True
+        except ValueError:
+            PYMORPHY_SUPPORT = False
+    return PYMORPHY_SUPPORT
+
+
+def lem_word(word, language):
+    """Lemmatize a word. We will use PyMorphy for RU, simplemma for others,
+    and if that isn't supported , we give up."""
+    if language == 'ru' and pymorphy_support():
+        return morph.parse(word)[0].normal_form
+    elif language in simplemma_languages:
+        global langdata
+        if langdata is None or langdata[0][0] != language:
+            langdata = simplemma.load_data(language)
+        return simplemma.lemmatize(word, langdata)
+    else:
+        return word
+
+
+def lemmatize_many(words: List[str], lang: str) -> List[str]:
+    return [lem_word(word, lang).lower() for word in words]
@@ -18,6 +18,7 @@ from .config import *
 from .tools import *
 from .db import *
 from .dictionary import *
+from .audio import downloader
 from .api import LanguageServer
 from . import __version__
 from .ext.reader import ReaderServer
@@ -85,10 +86,18 @@ class DictionaryWindow(QMainWindow):
         self.widget = QWidget()
         self.settings = QSettings()
         self.rec = Record()
+        for key in ("dict_source", "dict_source2"):
+            name = self.settings.value(key, "<disabled>")
+            if name not in ("<disabled>", "Wiktionary (English)", "Google Translate"):
+                # Suggestions for failed lookups need an index, built in the background
+                dictdb.buildFuzzy(self.settings.value("target_language", "en"), name)
         self.setCentralWidget(self.widget)
         self.previousWord = ""
         self.audio_path = ""
         self.image_path = None 
+        # Note waiting for its pronunciation to be downloaded
+        self.waiting_note: Optional[tuple] = None
+        downloader.finished.connect(self.onAudioDownloaded)
         self.scaleFont()
         self.initWidgets()
         if self.settings.value("orientation", "Vertical") == "Vertical":
@@ -709,7 +718,9 @@ class DictionaryWindow(QMainWindow):
             self.previousWord = target
             self.setSentence(sentence)
             self.setWord(target)
-            self.lookupSet(target)
+            # Texts prepared in the reader send the definition along
+            glossary = copyobj.get('glossary')
+            self.lookupSet(target, result=glossary if glossary and glossary.get('definition') else None)
         elif self.single_word.isChecked() and is_oneword(preprocess_clipboard(text, lang)):
             self.setSentence(word := preprocess_clipboard(text, lang))
             self.setWord(word)
@@ -717,14 +728,37 @@ class DictionaryWindow(QMainWindow):
         else:
             self.setSentence(preprocess_clipboard(text, lang))
 
-    def lookupSet(self, word, use_lemmatize=True):
+    def lookupSet(self, word, use_lemmatize=True, result=None):
         sentence_text = self.sentence.toPlainText()
         if self.settings.value("bold_word", True, type=bool):
             sentence_text = sentence_text.replace(
                 "_", "").replace(word, f"__{word}__")
         self.sentence.setText(sentence_text)
         QCoreApplication.processEvents()
-        result = self.lookup(word, use_lemmatize)
+        if result is None:
+            result = self.lookup(word, use_lemmatize)
+        else:
+            # Already found in the glossary of a text prepared in the reader
+            lemmatize = use_lemmatize and self.settings.value(
+                "lemmatization", True, type=bool)
+            dictname = result.get('dictname') or self.settings.value(
+                "dict_source", "Wiktionary (English)")
+            self.showLookup(word, lemmatize, dictname)
+            self.rec.recordLookup(
+                word,
+                result['definition'],
+                self.settings.value("target_language", "en"),
+                lemmatize,
+                dictname,
+                True)
+            if result.get('definition2') and result.get('dictname2'):
+                self.rec.recordLookup(
+                    word,
+                    result['definition2'],
+                    self.settings.value("target_language", "en"),
+                    lemmatize,
+                    result['dictname2'],
+                    True)
         self.setState(result)
         QCoreApplication.processEvents()
         self.audio_path = None
@@ -746,21 +780,15 @@ class DictionaryWindow(QMainWindow):
                     self.audio_selector.item(0)
                 )
 
-    def lookup(self, word, use_lemmatize=True, record=True):
+    def showLookup(self, word, lemmatize, dictname, record=True):
         """
-        Look up a word and return a dict with the lemmatized form (if enabled)
-        and definition
+        Show the frequency of a word that is looked up, and the lookup in
+        the status bar if it is recorded
         """
-        TL = self.settings.value("target_language", "en")
-        lemmatize = use_lemmatize and self.settings.value(
-            "lemmatization", True, type=bool)
+        language = self.settings.value("target_language", "en")
         lemfreq = self.settings.value("lemfreq", True, type=bool)
         short_sign = "Y" if lemmatize else "N"
-        language = TL  # This is in two letter code
-        gtrans_lang = self.settings.value("gtrans_lang", "en")
-        dictname = self.settings.value("dict_source", "Wiktionary (English)")
         freqname = self.settings.value("freq_source", "<disabled>")
-        word = re.sub('[«»…,()\\[\\]_]*', "", word)
         if freqname != "<disabled>":
             freq_found = False
             try:
@@ -779,14 +807,36 @@ class DictionaryWindow(QMainWindow):
         if record:
             self.status(
                 f"L: '{word}' in '{language}', lemma: {short_sign}, from {dictionaries.get(dictname, dictname)}")
+
+    def lookup(self, word, use_lemmatize=True, record=True):
+        """
+        Look up a word and return a dict with the lemmatized form (if enabled)
+        and definition
+        """
+        TL = self.settings.value("target_language", "en")
+        lemmatize = use_lemmatize and self.settings.value(
+            "lemmatization", True, type=bool)
+        language = TL  # This is in two letter code
+        gtrans_lang = self.settings.value("gtrans_lang", "en")
+        dictname = self.settings.value("dict_source", "Wiktionary (English)")
+        word = re.sub('[«»…,()\\[\\]_]*', "", word)
+        self.showLookup(word, lemmatize, dictname, record)
+        dict2name = self.settings.value("dict_source2", "<disabled>")
         try:
-            item = lookupin(
+            # Both dictionaries are looked up together, so that local
+            # dictionaries only cost a single query. The second one is
+            # not needed if the first one fails.
+            results = lookupin_many(
                 word,
                 language,
                 lemmatize,
-                dictname,
+                [dictname] if dict2name == "<disabled>" else [dictname, dict2name],
                 gtrans_lang,
-                self.settings.value("gtrans_api", "https://lingva.ml"))
+                self.settings.value("gtrans_api", "https://lingva.ml"),
+                first_required=True)
+            item = results[0]
+            if isinstance(item, Exception):
+                raise item
             if record:
                 self.rec.recordLookup(
                     word,
@@ -803,14 +853,16 @@ class DictionaryWindow(QMainWindow):
                 self.updateAnkiButtonState(True)
             item = {
                 "word": word,
-                "definition": failed_lookup(word, self.settings)
+                "definition": failed_lookup(
+                    word, self.settings, getattr(e, "suggestions", []))
             }
             return item
-        dict2name = self.settings.value("dict_source2", "<disabled>")
         if dict2name == "<disabled>":
             return item
         try:
-            item2 = lookupin(word, language, lemmatize, dict2name, gtrans_lang)
+            item2 = results[1]
+            if isinstance(item2, Exception):
+                raise item2
             if record:
                 self.rec.recordLookup(
                     word,
@@ -832,6 +884,9 @@ class DictionaryWindow(QMainWindow):
             'definition2': item2['definition']}
 
     def createNote(self):
+        if self.waiting_note is not None:
+            self.status("Still waiting for the pronunciation to be downloaded")
+            return
         sentence = self.sentence.toPlainText().replace("\n", "<br>")
         frequency_stars = self.freq_stars_display.text()
         if self.settings.value("bold_word", True, type=bool):
@@ -884,21 +939,42 @@ class DictionaryWindow(QMainWindow):
             except Exception as e:
                 return
 
+        note = (content, sentence, word, definition, definition2, tags, self.audio_path, self.image_path)
+        if self.audio_path and downloader.downloading(self.audio_path):
+            # Added by onAudioDownloaded, without blocking the window
+            self.waiting_note = note
+            self.status("Waiting for the pronunciation to be downloaded")
+            return
+        self.finishNote(*note)
+
+    def onAudioDownloaded(self, fpath: str, ok: bool):
+        if self.waiting_note is not None and self.waiting_note[6] == fpath:
+            note = self.waiting_note
+            self.waiting_note = None
+            self.finishNote(*note)
+
+    def finishNote(self, content, sentence, word, definition, definition2, tags, audio_path, image_path):
+        "Add a note built by createNote, once its files are ready"
+        if audio_path and not os.path.exists(audio_path):
+            audio_path = None
+        # The window may show another word by the time the audio is downloaded
+        current = self.word.text() == word
         if self.settings.value(
             "pronunciation_field",
-                "<disabled>") != '<disabled>' and self.audio_path:
+                "<disabled>") != '<disabled>' and audio_path:
             content['audio'] = {
-                "path": self.audio_path,
-                "filename": os.path.basename(self.audio_path),
+                "path": audio_path,
+                "filename": os.path.basename(audio_path),
                 "fields": [
                     self.settings.value("pronunciation_field")
                 ]
             }
-            self.audio_selector.clear()
-        if self.settings.value("image_field", "<disabled>") != '<disabled>' and self.image_path:
+            if current:
+                self.audio_selector.clear()
+        if self.settings.value("image_field", "<disabled>") != '<disabled>' and image_path:
             content['picture'] = {
-                "path": self.image_path,
-                "filename": os.path.basename(self.image_path),
+                "path": image_path,
+                "filename": os.path.basename(image_path),
                 "fields": [
                     self.settings.value("image_field")
                 ]
@@ -915,8 +991,8 @@ class DictionaryWindow(QMainWindow):
                     word,
                     definition,
                     definition2,
-                    self.audio_path,
-                    self.image_path,
+                    audio_path,
+                    image_path,
                     " ".join(tags),
                     True
                 )
@@ -927,15 +1003,16 @@ class DictionaryWindow(QMainWindow):
                     word,
                     definition,
                     definition2,
-                    self.audio_path,
-                    self.image_path,
+                    audio_path,
+                    image_path,
                     " ".join(tags),
                     False
                 )
-            self.sentence.clear()
-            self.word.clear()
-            self.definition.clear()
-            self.definition2.clear()
+            if current:
+                self.sentence.clear()
+                self.word.clear()
+                self.definition.clear()
+                self.definition2.clear()
             self.status(f"Note added: '{word}'")
         except Exception as e:
             self.rec.recordNote(
@@ -944,8 +1021,8 @@ class DictionaryWindow(QMainWindow):
                 word,
                 definition,
                 definition2,
-                self.audio_path,
-                self.image_path,
+                audio_path,
+                image_path,
                 " ".join(tags),
                 False
             )
@@ -961,7 +1038,8 @@ class DictionaryWindow(QMainWindow):
                 " Anki' on the Anki tab."
 
             )
-        self.setImage(None)
+        if current:
+            self.setImage(None)
 
     def process_defi_anki(self, w: MyTextEdit, display_mode):
         "Process definitions before sending to Anki"
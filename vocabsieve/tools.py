@@ -10,7 +10,7 @@ from .db import *
 from pystardict import Dictionary
 from .dictionary import *
 from .dictformats import *
-from .xdxftransform import xdxf2html
+from .xdxftransform import xdxf2html_many
 from PyQt5.QtCore import QCoreApplication
 
 
@@ -80,8 +80,12 @@ def is_json(myjson) -> bool:
     return True
 
 
-def failed_lookup(word, settings) -> str:
-    return str("<b>Definition for \"" + str(word) + "\" not found.</b><br>Check the following:<br>" +
+def failed_lookup(word, settings, suggestions=[]) -> str:
+    did_you_mean = ""
+    if suggestions:
+        did_you_mean = "Did you mean: " + ", ".join(suggestions) + "?<br>"
+    return str("<b>Definition for \"" + str(word) + "\" not found.</b><br>" + did_you_mean +
+               "Check the following:<br>" +
                "- Language setting (Current: " + settings.value("target_language", 'en') + ")<br>" +
                "- Is the correct word being looked up?<br>" +
                "- Are you connected to the Internet?<br>" +
@@ -104,29 +108,35 @@ def freq_to_stars(freq_num):
     else:
         return "★☆☆☆☆"
 
-def dictimport(path, dicttype, lang, name) -> None:
-    "Import dictionary from file to database"
-    if dicttype == "stardict":
+def dictimport(path, dicttype, lang, name, compress=False, attach=False) -> None:
+    """Import dictionary from file to database
+    If compress is set, definitions are stored compressed.
+    Frequency lists and audio libraries are never compressed.
+    If attach is set, the dictionary is read from its original files
+    instead, for the formats in attached_formats."""
+    if attach:
+        dictdb.attach(path, dicttype, lang, name)
+    elif dicttype == "stardict":
         stardict = Dictionary(os.path.splitext(path)[0], in_memory=True)
         d = {}
         if stardict.ifo.sametypesequence == 'x':
-            for key in stardict.idx.keys():
-                d[key] = xdxf2html(stardict.dict[key])
+            keys = list(stardict.idx.keys())
+            d = dict(zip(keys, xdxf2html_many([stardict.dict[key] for key in keys])))
         else:
             for key in stardict.idx.keys():
                 d[key] = stardict.dict[key]
-        dictdb.importdict(d, lang, name)
+        dictdb.importdict(d, lang, name, compress)
     elif dicttype == "json":
         with open(path, encoding="utf-8") as f:
             d = json.load(f)
-            dictdb.importdict(d, lang, name)
+            dictdb.importdict(d, lang, name, compress)
     elif dicttype == "migaku":
         with open(path, encoding="utf-8") as f:
             data = json.load(f)
             d = {}
             for item in data:
                 d[item['term']] = item['definition']
-            dictdb.importdict(d, lang, name)
+            dictdb.importdict(d, lang, name, compress)
     elif dicttype == "freq":
         with open(path, encoding="utf-8") as f:
             data = json.load(f)
@@ -135,36 +145,22 @@ def dictimport(path, dicttype, lang, name) -> None:
                 d[word] = str(i + 1)
             dictdb.importdict(d, lang, name)
     elif dicttype == "audiolib":
-        # Audios will be stored as a serialized json list
-        filelist = []
-        d = {}
-        for root, dirs, files in os.walk(path):
-            for item in files:
-                filelist.append(
-                    os.path.relpath(
-                        os.path.join(
-                            root, item), path))
-        for item in filelist:
-            headword = os.path.basename(os.path.splitext(item)[0]).lower()
-            if not d.get(headword):
-                d[headword] = [item]
-            else:
-                d[headword].append(item)
-        for word in d.keys():
-            d[word] = json.dumps(d[word])
-        dictdb.importdict(d, lang, name)
+        dictdb.indexAudio(name, lang, path)
     elif dicttype == 'mdx':
         d = parseMDX(path)
-        dictdb.importdict(d, lang, name)
+        dictdb.importdict(d, lang, name, compress)
     elif dicttype == "dsl":
         d = parseDSL(path)
-        dictdb.importdict(d, lang, name)
+        dictdb.importdict(d, lang, name, compress)
     elif dicttype == "csv":
         d = parseCSV(path)
-        dictdb.importdict(d, lang, name)
+        dictdb.importdict(d, lang, name, compress)
     elif dicttype == "tsv":
         d = parseTSV(path)
-        dictdb.importdict(d, lang, name)
+        dictdb.importdict(d, lang, name, compress)
+    if dicttype not in ("freq", "audiolib"):
+        # So that suggestions are ready by the time a lookup fails
+        dictdb.buildFuzzy(lang, name)
 
 
 def dictdelete(name) -> None:
@@ -2,9 +2,14 @@
 # and Ashwin V. Mohanan (ashwinvis)
 # Obtained and modified from pyglossary library
 # Using under the terms of the GNU GPLv3
-from typing import Union
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Union
 from io import BytesIO
 from io import StringIO
+from lxml import etree as ET
 
 
 class XdxfTransformer(object):
@@ -13,9 +18,10 @@ class XdxfTransformer(object):
 
     def __init__(self, encoding="utf-8"):
         self._encoding = encoding
+        self._buffer = BytesIO()
+        self._br = ET.Element("br")
 
     def tostring(self, elem: "lxml.etree.Element") -> str:
-        from lxml import etree as ET
         return ET.tostring(
             elem,
             method="html",
@@ -46,14 +52,13 @@ class XdxfTransformer(object):
             parent: "lxml.etree.Element",
             prev: "Union[None, str, lxml.etree.Element]",
     ):
-        from lxml import etree as ET
         hasPrev = self.hasPrevText(prev)
         trailNL = False
         if parent.tag in ("ar", "font"):
             if child.startswith("\n"):
                 child = child.lstrip("\n")
                 if hasPrev:
-                    hf.write(ET.Element("br"))
+                    hf.write(self._br)
             elif child.endswith("\n"):
                 child = child.rstrip("\n")
                 trailNL = True
@@ -61,14 +66,14 @@ class XdxfTransformer(object):
                 child = child.lstrip()
         elif child.startswith("\n"):
             child = child.lstrip()
-            hf.write(ET.Element("br"))
+            hf.write(self._br)
 
         for index, parag in enumerate(child.split("\n")):
             if index > 0:
-                hf.write(ET.Element("br"))
+                hf.write(self._br)
             hf.write(parag)
         if trailNL:
-            hf.write(ET.Element("br"))
+            hf.write(self._br)
         return
 
     def writeExample(
@@ -126,14 +131,12 @@ class XdxfTransformer(object):
             parent: "lxml.etree.Element",
             prev: "Union[None, str, lxml.etree.Element]",
     ):
-        from lxml import etree as ET
-
         if isinstance(child, str):
             self.writeString(hf, child, parent, prev)
             return
 
         if child.tag == f"br":
-            hf.write(ET.Element("br"))
+            hf.write(self._br)
             return
 
         if child.tag in ("i", "b", "sub", "sup", "tt", "big", "small"):
@@ -282,24 +285,95 @@ class XdxfTransformer(object):
             prev = child
 
     def transform(self, article: "lxml.etree.Element") -> str:
-        from lxml import etree as ET
-        encoding = self._encoding
-        f = BytesIO()
+        f = self._buffer
+        f.seek(0)
+        f.truncate()
         with ET.htmlfile(f, encoding="utf-8") as hf:
             with hf.element("div", **{"class": "article"}):
                 self.writeChildrenOf(hf, article)
 
-        text = f.getvalue().decode("utf-8")
+        text: str = f.getvalue().decode("utf-8")
         text = text.replace("<br>", "<br/>")  # for compatibility
         return text
 
     def transformByInnerString(self, articleInnerStr: str) -> str:
-        from lxml import etree as ET
         return self.transform(
             ET.fromstring(f"<ar>{articleInnerStr}</ar>")
         )
 
 
+# The transformer reuses its output buffer, so every thread needs its own
+_local = threading.local()
+
+# Articles sent to each worker process at once
+XDXF_CHUNK_SIZE = 500
+# Below this number of articles, starting the worker processes costs more
+# than it saves
+XDXF_PARALLEL_MIN_COUNT = 20000
+
+
 def xdxf2html(s: str) -> str:
-    t = XdxfTransformer()
-    return t.transformByInnerString(s)
+    transformer = getattr(_local, "transformer", None)
+    if transformer is None:
+        transformer = _local.transformer = XdxfTransformer()
+    return transformer.transformByInnerString(s)
+
+
+def xdxf2html_many(articles: List[str], processes: Optional[int] = None) -> List[str]:
+    """Convert a list of XDXF articles, in the same order.
+    Large lists are converted in a process pool."""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1 and len(articles) >= XDXF_PARALLEL_MIN_COUNT:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(xdxf2html, articles, chunksize=XDXF_CHUNK_SIZE))
+    return [xdxf2html(article) for article in articles]
+
+
+def benchmark(count: int = 20000, path: Optional[str] = None, seed: int = 0):
+    """
+    Measure converting count generated XDXF articles, or those of the
+    StarDict dictionary at path, on one core and in a process pool.
+    Run with python -m vocabsieve.xdxftransform [count | dictionary.ifo]
+    """
+    import random
+    import time
+    if path is not None:
+        from pystardict import Dictionary
+        stardict = Dictionary(os.path.splitext(path)[0], in_memory=True)
+        articles = [stardict.dict[key] for key in stardict.idx.keys()]
+    else:
+        rng = random.Random(seed)
+        words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10))) for _ in range(5000)]
+
+        def sentence(n: int) -> str:
+            return " ".join(rng.choices(words, k=n))
+        articles = []
+        for i in range(count):
+            senses = "".join(
+                f"<def><gr>{rng.choice(['n', 'v', 'adj'])}</gr> <dtrn>{sentence(rng.randint(2, 8))}</dtrn>"
+                f"<ex><ex_orig>{sentence(rng.randint(4, 10))}</ex_orig> <ex_tran>{sentence(rng.randint(4, 10))}"
+                f"</ex_tran></ex> <co>see <kref>{rng.choice(words)}</kref></co></def>"
+                for _ in range(rng.randint(1, 4)))
+            articles.append(f"<k>{rng.choice(words)}{i}</k> <tr>{rng.choice(words)}</tr>{senses}")
+
+    start = time.perf_counter()
+    serial = xdxf2html_many(articles, processes=1)
+    serial_time = time.perf_counter() - start
+    print(f"{len(articles)} articles")
+    print(f"1 process: {serial_time:.2f} s")
+    processes = os.cpu_count() or 1
+    if processes > 1 and len(articles) >= XDXF_PARALLEL_MIN_COUNT:
+        start = time.perf_counter()
+        pooled = xdxf2html_many(articles, processes)
+        print(f"{processes} processes: {time.perf_counter() - start:.2f} s")
+        if pooled != serial:
+            print("The results differ")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and not sys.argv[1].isdigit():
+        benchmark(path=sys.argv[1])
+    else:
+        benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)